@@ -0,0 +1,146 @@
+"""
+Benchmark the analysis pipeline (:func:`.combine_traces`, :func:`.latency.minmax`,
+:func:`.latency.extract_latencies`, :func:`.cache.cached_latencies`) on synthetic traces
+from :mod:`.synthetic`, measuring throughput and peak memory of each stage and
+checking recovered latencies against the ground truth.
+"""
+
+import tempfile
+import time
+import tracemalloc
+import typing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from plugin_paper.analysis.cache import LatencyCache, cached_latencies
+from plugin_paper.analysis.combine_traces import combine_traces
+from plugin_paper.analysis.latency import extract_latencies, minmax
+from plugin_paper.analysis.synthetic import write_traces
+
+
+def measure(func:typing.Callable[[], typing.Any], n_samples:int, repeat:int=5) -> dict:
+    """
+    Time ``func`` over ``repeat`` runs, then run it once more under :mod:`tracemalloc`
+    to find its peak memory (separately, since tracing slows it down).
+
+    Returns:
+        dict with ``seconds`` (median), ``samples_per_sec``, and ``peak_bytes``
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        func()
+        times.append(time.perf_counter_ns() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    seconds = float(np.median(times)) / 1e9
+    return {
+        'seconds': seconds,
+        'samples_per_sec': n_samples / seconds,
+        'peak_bytes': peak
+    }
+
+
+def check_accuracy(recovered:pd.DataFrame, truth:pd.DataFrame, tolerance:float) -> dict:
+    """
+    Compare latencies from :func:`.cache.cached_latencies` (or anything with ``file``, ``trace``, and
+    ``latencies`` columns) against the ground truth from :func:`.synthetic.write_traces`
+
+    Args:
+        recovered (:class:`pandas.DataFrame`): Extracted latencies
+        truth (:class:`pandas.DataFrame`): Ground truth
+        tolerance (float): Maximum difference (in seconds) to count a latency as correct,
+            eg. one or two sample periods
+
+    Returns:
+        dict with ``n``, ``n_correct``, ``false_misses`` (responses that weren't found),
+        ``false_hits`` (latencies found where there was no response), and ``max_error``
+    """
+    merged = truth.merge(recovered, on=['file', 'trace'], how='left')
+    actual = merged['latency'].to_numpy(dtype=float)
+    found = pd.to_numeric(merged['latencies']).to_numpy(dtype=float)
+    both = ~np.isnan(actual) & ~np.isnan(found)
+    error = np.abs(found[both] - actual[both])
+    return {
+        'n': len(merged),
+        'n_correct': int(np.sum(error <= tolerance) + np.sum(np.isnan(actual) & np.isnan(found))),
+        'false_misses': int(np.sum(~np.isnan(actual) & np.isnan(found))),
+        'false_hits': int(np.sum(np.isnan(actual) & ~np.isnan(found))),
+        'max_error': float(error.max()) if error.shape[0] > 0 else np.nan
+    }
+
+
+def benchmark_pipeline(n_recordings:int=4,
+                       repeat:int=5,
+                       path:typing.Optional[Path]=None,
+                       seed:int=0,
+                       threshold:float=0.5,
+                       minmax_:typing.Optional[bool]=None,
+                       **kwargs) -> typing.Tuple[pd.DataFrame, dict]:
+    """
+    Benchmark each stage of the analysis pipeline on synthetic traces.
+
+    Args:
+        n_recordings (int): Number of recordings (.csv files) to generate
+        repeat (int): Number of timed runs of each stage
+        path (:class:`pathlib.Path`): Directory to write traces to, otherwise a temporary directory
+        seed (int): Seed for generating traces
+        threshold (float): Threshold for :func:`.latency.extract_latencies`
+        minmax_ (bool): Normalize with :func:`.latency.minmax` before extracting latencies. Traces with
+            no response are pure noise, which normalizing stretches across the threshold, so by default
+            only normalize when there are no misses (``miss_rate`` is 0) and otherwise use the raw
+            ``threshold`` (in volts) so misses can be checked against the ground truth.
+        **kwargs: passed to :func:`.synthetic.make_traces` , eg. ``n_frames``, ``n_samples``, ``noise``
+
+    Returns:
+        tuple(:class:`pandas.DataFrame`, dict): Throughput and peak memory for each stage,
+        and the accuracy of recovered latencies from :func:`.check_accuracy`
+    """
+    if minmax_ is None:
+        minmax_ = kwargs.get('miss_rate', 0) == 0
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if path is None:
+            path = Path(tmpdir) / 'traces'
+        truth = write_traces(path, n_recordings=n_recordings, seed=seed, **kwargs)
+
+        traces = combine_traces(path)
+        n_samples = len(traces)
+        stages = {
+            'combine_traces': lambda: combine_traces(path),
+            'minmax': lambda: minmax(traces, 'CH_CHAN1', inplace=False),
+            'extract_latencies': lambda: extract_latencies(traces, threshold=threshold, minmax_=minmax_),
+        }
+
+        results = []
+        for stage, func in stages.items():
+            results.append({'stage': stage, **measure(func, n_samples, repeat)})
+
+        # caching: cold runs need a fresh cache each time, so time them with a new cache dir per run
+        cache_dirs = iter(range(repeat + 1))
+        results.append({'stage': 'cached_latencies (cold)', **measure(
+            lambda: cached_latencies(path, cache=LatencyCache(Path(tmpdir) / f'cache_{next(cache_dirs)}'),
+                                     threshold=threshold, minmax_=minmax_),
+            n_samples, repeat
+        )})
+        warm_cache = LatencyCache(Path(tmpdir) / 'cache_warm')
+        recovered = cached_latencies(path, cache=warm_cache, threshold=threshold, minmax_=minmax_)
+        results.append({'stage': 'cached_latencies (warm)', **measure(
+            lambda: cached_latencies(path, cache=warm_cache, threshold=threshold, minmax_=minmax_),
+            n_samples, repeat
+        )})
+
+    # a correct crossing is within a sample period of the true latency, allow two
+    time_values = traces['time'].drop_duplicates().sort_values().to_numpy()
+    tolerance = 2 * float(np.median(np.diff(time_values)))
+    accuracy = check_accuracy(recovered, truth, tolerance)
+
+    return pd.DataFrame(results), accuracy
@@ -0,0 +1,207 @@
+"""
+On-disk cache of latencies extracted from traces saved by :func:`~.save_trace.save_all_traces`
+
+Old recordings don't change, so rather than re-parsing every .csv and re-running
+:func:`.latency.extract_latencies` each time a directory is analyzed, results for each
+file are stored keyed by a hash of the file's contents and the extraction parameters.
+Only new or modified files are processed.
+"""
+
+import hashlib
+import json
+import os
+import time
+import typing
+from pathlib import Path
+
+import pandas as pd
+
+from plugin_paper.analysis.latency import extract_latencies
+
+CACHE_VERSION = 1
+"""
+Increment when the stored format or extraction logic changes to invalidate old entries
+"""
+
+
+class LatencyCache:
+    """
+    Size-bounded cache of per-file latency results with least-recently-used eviction.
+
+    Each entry is a small .csv in ``path``, and ``index.json`` keeps track of entry sizes,
+    when they were last used, and the (size, mtime) of source files that have already been
+    hashed so unchanged files don't need to be re-read to find their key.
+
+    Args:
+        path (:class:`pathlib.Path`): Directory to store the cache in. Default ``~/.cache/plugin_paper/latencies``
+        max_bytes (int): Maximum total size of stored entries before the least recently used are evicted.
+    """
+
+    INDEX = 'index.json'
+
+    def __init__(self, path:typing.Optional[Path]=None, max_bytes:int=256*1024*1024):
+        if path is None:
+            path = Path.home() / '.cache' / 'plugin_paper' / 'latencies'
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self._index = self._load_index()
+
+    def _load_index(self) -> dict:
+        index_path = self.path / self.INDEX
+        try:
+            with open(index_path, 'r') as ifile:
+                index = json.load(ifile)
+            if index.get('version') != CACHE_VERSION:
+                raise ValueError('cache version changed')
+        except (FileNotFoundError, ValueError):
+            index = {'version': CACHE_VERSION, 'entries': {}, 'files': {}}
+        return index
+
+    def prune_files(self):
+        """
+        Forget hashes of source files that no longer exist so the index doesn't grow without bound
+        """
+        files = self._index['files']
+        for file in [f for f in files if not Path(f).exists()]:
+            del files[file]
+
+    def save_index(self):
+        self.prune_files()
+        tmp_path = self.path / (self.INDEX + '.tmp')
+        with open(tmp_path, 'w') as ifile:
+            json.dump(self._index, ifile)
+        os.replace(tmp_path, self.path / self.INDEX)
+
+    def file_hash(self, file:Path) -> str:
+        """
+        sha256 of a file's contents, reusing the stored hash if its size and mtime are unchanged
+        """
+        file = Path(file)
+        stat = file.stat()
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        known = self._index['files'].get(str(file.resolve()))
+        if known is not None and known['stat'] == stamp:
+            return known['hash']
+
+        digest = hashlib.sha256()
+        with open(file, 'rb') as tfile:
+            for chunk in iter(lambda: tfile.read(1024*1024), b''):
+                digest.update(chunk)
+        file_hash = digest.hexdigest()
+        self._index['files'][str(file.resolve())] = {'stat': stamp, 'hash': file_hash}
+        return file_hash
+
+    @staticmethod
+    def key(file_hash:str, **params) -> str:
+        """
+        Combine a file hash with extraction parameters into a cache key
+        """
+        param_str = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(f"{file_hash}{param_str}".encode('utf-8')).hexdigest()
+
+    def get(self, key:str) -> typing.Optional[pd.DataFrame]:
+        entry = self._index['entries'].get(key)
+        if entry is None:
+            return None
+        try:
+            result = pd.read_csv(self.path / f"{key}.csv")
+        except FileNotFoundError:
+            del self._index['entries'][key]
+            return None
+        entry['used'] = time.time()
+        return result
+
+    def put(self, key:str, result:pd.DataFrame):
+        entry_path = self.path / f"{key}.csv"
+        result.to_csv(entry_path, index=False)
+        self._index['entries'][key] = {
+            'size': entry_path.stat().st_size,
+            'used': time.time()
+        }
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is within ``max_bytes``
+        """
+        entries = self._index['entries']
+        total = sum(e['size'] for e in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['used']):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]['size']
+            del entries[key]
+            try:
+                (self.path / f"{key}.csv").unlink()
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        for key in list(self._index['entries']):
+            try:
+                (self.path / f"{key}.csv").unlink()
+            except FileNotFoundError:
+                pass
+        self._index = {'version': CACHE_VERSION, 'entries': {}, 'files': {}}
+        self.save_index()
+
+
+def cached_latencies(path:Path,
+                     cache:typing.Optional[LatencyCache]=None,
+                     response_col:str="CH_CHAN1",
+                     threshold:float=0.5,
+                     minmax_:bool=False) -> pd.DataFrame:
+    """
+    Extract latencies from a directory of traces like :func:`.combine_traces` followed by
+    :func:`.latency.extract_latencies`, but only processing files that aren't already in the cache.
+
+    Files are sorted by name so that ``recording`` numbers are stable between calls.
+
+    Args:
+        path (:class:`pathlib.Path`): Directory containing .csv traces
+        cache (:class:`.LatencyCache`): Cache to use, if ``None`` use the default location
+        response_col (str): passed to :func:`.latency.extract_latencies`
+        threshold (float): passed to :func:`.latency.extract_latencies`
+        minmax_ (bool): passed to :func:`.latency.extract_latencies`
+
+    Returns:
+        :class:`pandas.DataFrame` with columns ``group`` (``(trace, recording)``, as in
+        :func:`~.latency.extract_latencies`), ``latencies`` (``NaN`` for misses), ``trace``, ``recording``, and ``file``
+    """
+    if cache is None:
+        cache = LatencyCache()
+
+    params = {
+        'response_col': response_col,
+        'threshold': threshold,
+        'minmax_': minmax_
+    }
+
+    results = []
+    try:
+        for i, file in enumerate(sorted(Path(path).glob('*.csv'))):
+            key = cache.key(cache.file_hash(file), **params)
+            result = cache.get(key)
+            if result is None:
+                trace = pd.read_csv(file)
+                trace['recording'] = 0
+                latencies = extract_latencies(trace, groupby=('trace', 'recording'), **params)
+                # misses are None from extract_latencies but NaN once read back from the cache,
+                # so make them NaN either way
+                result = pd.DataFrame({
+                    'trace': [group[0] for group in latencies['group']],
+                    'latencies': pd.to_numeric(latencies['latencies'])
+                })
+                cache.put(key, result)
+            else:
+                result['latencies'] = pd.to_numeric(result['latencies'])
+
+            result['recording'] = i
+            result['file'] = str(file)
+            result['group'] = list(zip(result['trace'], result['recording']))
+            results.append(result)
+    finally:
+        cache.save_index()
+
+    return pd.concat(results, ignore_index=True)[['group', 'latencies', 'trace', 'recording', 'file']]
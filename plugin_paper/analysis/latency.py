@@ -2,16 +2,70 @@
 Helper functions for computing oscilloscope latencies combined with :mod:`.combine_traces`
 """
 
+import typing
+
 import pandas as pd
 import numpy as np
 
 
-def minmax(df:pd.DataFrame, col:str, groupby:tuple=('trace', 'recording')) -> pd.DataFrame:
-    df[col] = df.groupby(list(groupby))[col].transform(
-        lambda x: (x-x.min())/(x.max()-x.min())
-    )
+def minmax(df:pd.DataFrame,
+           col:str,
+           groupby:tuple=('trace', 'recording'),
+           robust:bool=False,
+           quantiles:typing.Tuple[float, float]=(0.01, 0.99),
+           inplace:bool=True) -> pd.DataFrame:
+    """
+    Normalize a column to 0-1 within each group.
+
+    Group minimums and maximums are computed with groupby aggregates and broadcast
+    back to each row, rather than calling a python function per group.
+
+    Args:
+        df (:class:`pandas.DataFrame`): Traces, eg. from :func:`.combine_traces`
+        col (str): Column to normalize
+        groupby (tuple): Columns that identify a single trace
+        robust (bool): If ``True``, use the ``quantiles`` of each group rather than its
+            min and max, so brief spikes don't compress the rest of the trace. Values outside
+            the quantiles are clipped to 0-1.
+        quantiles (tuple[float, float]): Lower and upper quantiles used when ``robust``
+        inplace (bool): If ``True`` (default), overwrite ``col`` in ``df``. Otherwise
+            return a copy with the normalized column.
+
+    Returns:
+        :class:`pandas.DataFrame` with ``col`` normalized
+    """
+    grouped = df.groupby(list(groupby), sort=False)[col]
+    if robust:
+        lo = np.array(grouped.transform('quantile', quantiles[0]), dtype=float)
+        hi = np.array(grouped.transform('quantile', quantiles[1]), dtype=float)
+    else:
+        lo = np.array(grouped.transform('min'), dtype=float)
+        hi = np.array(grouped.transform('max'), dtype=float)
+
+    # flat traces have no range, leave them as NaN like 0/0 would
+    hi -= lo
+    hi[hi == 0] = np.nan
+
+    normed = df[col].to_numpy(dtype=float, copy=True)
+    normed -= lo
+    normed /= hi
+    if robust:
+        np.clip(normed, 0, 1, out=normed)
+
+    if not inplace:
+        df = df.copy()
+    df[col] = normed
     return df
 
+def first_crossing(time:np.ndarray, samples:np.ndarray, threshold:float=0.5) -> typing.Optional[float]:
+    """
+    Time of the first sample that is above ``threshold``, or ``None`` if it never crosses
+    """
+    idx = np.flatnonzero(samples > threshold)
+    if idx.shape[0] == 0:
+        return None
+    return time[idx[0]]
+
 def extract_latencies(traces:pd.DataFrame,
                       response_col:str="CH_CHAN1",
                       groupby:tuple=('trace', 'recording'),
@@ -21,23 +75,12 @@ def extract_latencies(traces:pd.DataFrame,
 
     # normalize both traces to 0-1
     if minmax_:
-        traces = minmax(traces, response_col)
+        traces = minmax(traces, response_col, groupby=groupby, inplace=False)
 
     latencies = []
     groups = []
     for i, group in traces.groupby(list(groupby)):
-        try:
-            idx = np.where(group[response_col] > threshold)[0]
-            latencies.append(group['time'].iloc[idx[0]])
-            groups.append(i)
-        except IndexError:
-            latencies.append(None)
-            groups.append(i)
+        latencies.append(first_crossing(group['time'].to_numpy(), group[response_col].to_numpy(), threshold))
+        groups.append(i)
 
     return pd.DataFrame({'group': groups, 'latencies':latencies})
-
-
-
-
-
-
@@ -0,0 +1,137 @@
+"""
+Summary statistics and bootstrapped confidence intervals for latencies
+returned by :func:`.latency.extract_latencies`
+"""
+
+import typing
+
+import numpy as np
+import pandas as pd
+
+STATS = {
+    'mean': lambda x: np.mean(x, axis=1),
+    'median': lambda x: np.median(x, axis=1),
+}
+"""
+Statistics that can be bootstrapped by name, each takes a ``(n_resamples, n_samples)`` array
+and returns one value per resample.
+"""
+
+
+def bootstrap_ci(values:np.ndarray,
+                 stat:typing.Union[str, typing.Callable[[np.ndarray], np.ndarray]]='median',
+                 n_boot:int=2000,
+                 ci:float=0.95,
+                 seed:int=0,
+                 max_elements:int=2**24) -> typing.Tuple[float, float]:
+    """
+    Percentile bootstrap confidence interval of some statistic.
+
+    Resamples are drawn in batches as a single ``(batch, n)`` index array so each batch is one
+    vectorized numpy call, with ``batch`` chosen so that no more than ``max_elements``
+    samples are held in memory at once.
+
+    Args:
+        values (:class:`numpy.ndarray`): 1D array of values, NaNs are dropped
+        stat (str, callable): Name of a statistic in :data:`.STATS`, or a function that takes
+            a 2D array of resamples and returns the statistic along ``axis=1``
+        n_boot (int): Number of resamples
+        ci (float): Width of the confidence interval
+        seed (int): Seed for the random number generator, so intervals are reproducible
+        max_elements (int): Maximum size of a batch of resamples
+
+    Returns:
+        tuple(float, float): lower and upper bounds of the confidence interval
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    n = values.shape[0]
+    if n == 0:
+        return np.nan, np.nan
+
+    if isinstance(stat, str):
+        stat = STATS[stat]
+
+    rng = np.random.default_rng(seed)
+    batch = max(1, min(n_boot, max_elements // n))
+    boots = np.empty(n_boot, dtype=float)
+    for start in range(0, n_boot, batch):
+        stop = min(start + batch, n_boot)
+        idx = rng.integers(0, n, size=(stop - start, n))
+        boots[start:stop] = stat(values[idx])
+
+    alpha = (1 - ci) / 2
+    low, high = np.quantile(boots, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def _summarize(values:np.ndarray,
+               percentiles:typing.Sequence[float],
+               **kwargs) -> dict:
+    values = np.asarray(values, dtype=float)
+    missed = np.isnan(values)
+    hits = values[~missed]
+
+    summary = {
+        'n': values.shape[0],
+        'n_miss': int(missed.sum()),
+        'miss_rate': float(missed.mean()) if values.shape[0] > 0 else np.nan,
+        'mean': float(np.mean(hits)) if hits.shape[0] > 0 else np.nan,
+        'std': float(np.std(hits)) if hits.shape[0] > 0 else np.nan,
+    }
+    if hits.shape[0] > 0:
+        pcts = np.percentile(hits, percentiles)
+    else:
+        pcts = np.full(len(percentiles), np.nan)
+    for pct, value in zip(percentiles, pcts):
+        summary[f"p{pct:g}"] = float(value)
+
+    summary['ci_low'], summary['ci_high'] = bootstrap_ci(hits, **kwargs)
+    return summary
+
+
+def summarize(latencies:typing.Union[pd.DataFrame, pd.Series, np.ndarray],
+              col:str='latencies',
+              by:typing.Optional[typing.Union[str, typing.List[str]]]=None,
+              percentiles:typing.Sequence[float]=(5, 25, 50, 75, 95, 99),
+              stat:typing.Union[str, typing.Callable[[np.ndarray], np.ndarray]]='median',
+              n_boot:int=2000,
+              ci:float=0.95,
+              seed:int=0) -> pd.DataFrame:
+    """
+    Summarize latencies: number of traces, misses (traces that never crossed threshold,
+    ``None`` in :func:`.latency.extract_latencies`), mean, std, percentiles, and a
+    bootstrapped confidence interval of ``stat``.
+
+    Args:
+        latencies (:class:`pandas.DataFrame`, :class:`numpy.ndarray`): Output of
+            :func:`.latency.extract_latencies` (optionally with additional columns to group by),
+            or an array of latencies
+        col (str): Column of latencies if given a DataFrame
+        by (str, list[str]): Optional: Column(s) to summarize separately, eg. jackd configuration or GPIO backend.
+        percentiles (list[float]): Percentiles (0-100) to compute
+        stat, n_boot, ci, seed: passed to :func:`.bootstrap_ci`
+
+    Returns:
+        :class:`pandas.DataFrame` with one row per group (or a single row if ``by`` is ``None``)
+    """
+    kwargs = {'stat': stat, 'n_boot': n_boot, 'ci': ci, 'seed': seed}
+
+    if isinstance(latencies, pd.DataFrame):
+        if by is not None:
+            rows = []
+            keys = []
+            for key, group in latencies.groupby(by):
+                keys.append(key)
+                rows.append(_summarize(pd.to_numeric(group[col]).to_numpy(dtype=float), percentiles, **kwargs))
+            if isinstance(by, str):
+                index = pd.Index(keys, name=by)
+            else:
+                index = pd.MultiIndex.from_tuples(keys, names=by)
+            return pd.DataFrame(rows, index=index)
+        latencies = latencies[col]
+    elif by is not None:
+        raise ValueError("Can only summarize by group when given a DataFrame")
+
+    values = pd.to_numeric(pd.Series(latencies)).to_numpy(dtype=float)
+    return pd.DataFrame([_summarize(values, percentiles, **kwargs)])
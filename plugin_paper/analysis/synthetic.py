@@ -0,0 +1,108 @@
+"""
+Synthetic oscilloscope traces in the same format as :func:`~.save_trace.save_all_traces`
+with known latencies, for testing and benchmarking the analysis functions without
+real recordings.
+"""
+
+import typing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+def make_traces(n_frames:int=100,
+                n_samples:int=1200,
+                channels:typing.Sequence[str]=('CHAN1', 'CHAN2'),
+                latency:float=0.001,
+                jitter:float=0.0001,
+                noise:float=0.05,
+                amplitude:float=3.3,
+                timebase:typing.Tuple[float, float]=(-0.001, 0.005),
+                miss_rate:float=0,
+                first_frame:int=1,
+                rng:typing.Optional[np.random.Generator]=None) -> typing.Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Make a set of traces like those from one recording of :func:`~.save_trace.save_all_traces`
+
+    The first channel is the response, which steps from 0 to ``amplitude`` at a
+    random latency after the trigger (time = 0). The second channel is the trigger,
+    which steps at time = 0, and any further channels are just noise.
+
+    Args:
+        n_frames (int): Number of traces (frames in the scope's recording memory)
+        n_samples (int): Samples per trace
+        channels (list[str]): Names of displayed channels, columns are named ``CH_{channel}``
+        latency (float): Mean latency of the response, in seconds
+        jitter (float): Standard deviation of the latency, in seconds
+        noise (float): Standard deviation of gaussian noise added to each sample
+        amplitude (float): Height of the steps
+        timebase (tuple[float, float]): Start and end time of each trace relative to the trigger, in seconds
+        miss_rate (float): Proportion of traces where the response never happens
+        first_frame (int): Index of the first trace
+        rng (:class:`numpy.random.Generator`): Random number generator, default unseeded
+
+    Returns:
+        tuple(:class:`pandas.DataFrame`, :class:`pandas.DataFrame`): Traces with columns ``time``,
+        ``CH_{channel}`` for each channel, and ``trace``; and the ground truth with columns ``trace``
+        and ``latency`` (``NaN`` for misses)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    times = np.linspace(timebase[0], timebase[1], n_samples)
+    latencies = rng.normal(latency, jitter, n_frames)
+    latencies[rng.random(n_frames) < miss_rate] = np.nan
+    traces = np.arange(first_frame, first_frame + n_frames)
+
+    data = {'time': np.tile(times, n_frames)}
+    for i, channel in enumerate(channels):
+        if i == 0:
+            # comparisons with NaN are False, so misses never step
+            samples = (times[None, :] >= latencies[:, None]) * amplitude
+        elif i == 1:
+            samples = np.broadcast_to((times >= 0) * amplitude, (n_frames, n_samples))
+        else:
+            samples = np.zeros((n_frames, n_samples))
+        samples = samples + rng.normal(0, noise, (n_frames, n_samples))
+        data[f"CH_{channel}"] = samples.ravel()
+    data['trace'] = np.repeat(traces, n_samples)
+
+    return pd.DataFrame(data), pd.DataFrame({'trace': traces, 'latency': latencies})
+
+
+def write_traces(path:Path,
+                 n_recordings:int=1,
+                 base_name:str="OscTrace",
+                 seed:typing.Optional[int]=None,
+                 **kwargs) -> pd.DataFrame:
+    """
+    Write synthetic recordings to a directory as :func:`~.save_trace.save_all_traces` would,
+    as ``{base_name}_{n}.csv`` where ``n`` increments from the number of existing traces.
+
+    Args:
+        path (:class:`pathlib.Path`): Directory to save traces in
+        n_recordings (int): Number of recordings (.csv files) to write
+        base_name (str): Base name of output files
+        seed (int): Seed for the random number generator
+        **kwargs: passed to :func:`.make_traces`
+
+    Returns:
+        :class:`pandas.DataFrame` of ground truth with columns ``file``, ``trace``, and ``latency``
+    """
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    rng = np.random.default_rng(seed)
+
+    truths = []
+    for _ in range(n_recordings):
+        trace_n = len(list(path.glob(f'{base_name}*.csv')))
+        out_fn = path / f"{base_name}_{trace_n}.csv"
+
+        traces, truth = make_traces(rng=rng, **kwargs)
+        traces.to_csv(out_fn, index=False)
+
+        truth['file'] = str(out_fn)
+        truths.append(truth)
+
+    return pd.concat(truths, ignore_index=True)[['file', 'trace', 'latency']]
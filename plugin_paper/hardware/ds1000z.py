@@ -1,8 +1,11 @@
 from autopilot.hardware import Hardware
 from ds1054z import DS1054Z as DS1054Z_
 from pathlib import Path
+import time
 import typing
+import numpy as np
 import pandas as pd
+from plugin_paper.analysis.latency import first_crossing
 
 class SCPI(Hardware):
     """Metaclass for SCPI-based hardware devices"""
@@ -20,11 +23,19 @@ class DS1054Z(SCPI):
     """
     TRACE_MODES = typing.Literal['NORM', 'RAW', 'MAX']
 
-    def __init__(self, ip:str, **kwargs):
+    def __init__(self, ip:str, scope:typing.Optional[DS1054Z_]=None, **kwargs):
+        """
+        Args:
+            ip (str): IP address of the oscilloscope
+            scope: Optional: An already-connected scope object (eg. :class:`.SimulatedDS1054Z` )
+                to use instead of connecting to ``ip``
+        """
         super(DS1054Z, self).__init__(**kwargs)
 
         self.ip = ip
-        self.scope = DS1054Z_(self.ip)
+        if scope is None:
+            scope = DS1054Z_(self.ip)
+        self.scope = scope
 
     def __getattr__(self, item:str):
         """If we don't have the method in this class, try and use the device's methods"""
@@ -92,3 +103,213 @@ class DS1054Z(SCPI):
                 self.logger.exception(f"Could not save traces to {str(path)}")
 
         return dfs
+
+    def stream_latencies(self,
+            n_frames: typing.Optional[int] = None,
+            channel: str = "CHAN1",
+            threshold: float = 0.5,
+            minmax_: bool = False,
+            path: typing.Optional[Path] = None,
+            decimate: typing.Optional[int] = None,
+            mode: TRACE_MODES = "NORM",
+            timeout: float = 10,
+            poll_interval: float = 0.001) -> pd.DataFrame:
+        """
+        Continuously capture single-shot triggers and extract latencies as each frame arrives.
+
+        Unlike :meth:`.save_traces`, which replays frames from the scope's recording memory
+        after the fact, the scope is re-armed with ``:SINGle`` after each frame is pulled,
+        so runs aren't limited by scope memory. Each waveform is thresholded as it arrives
+        (as in :func:`~.latency.extract_latencies`) and only the latency is kept. If ``path``
+        is given, latencies are only appended to it and read back once capture stops, so memory
+        use doesn't grow with the length of the recording -- use it for runs until interrupted.
+
+        Args:
+            n_frames (int): Number of frames to capture. If ``None`` (default), run until interrupted
+            channel (str): Channel to detect threshold crossings on
+            threshold (float): Threshold for the response channel
+            minmax_ (bool): Normalize each waveform to 0-1 before thresholding
+            path (:class:`pathlib.Path`): File (.csv) to append latencies to as they are
+                captured, if present, rather than keeping them in memory.
+            decimate (int): Optional: if present, also append every ``decimate``-th sample of each
+                displayed channel to ``{path}_traces.csv`` in the same format as :meth:`.save_traces`.
+                Requires ``path``.
+            mode (str): Waveform mode, see :meth:`.save_traces`
+            timeout (float): Seconds to wait for each trigger before giving up
+            poll_interval (float): Seconds between checks of the trigger status
+
+        Returns:
+            (:class:`pandas.DataFrame`): A dataframe with a ``trace`` index and ``latencies``
+                (in seconds, ``NaN`` if the response never crossed ``threshold``)
+        """
+        if decimate is not None and path is None:
+            raise ValueError("Need a path to save decimated traces to")
+
+        lat_file = None
+        trace_file = None
+        if path is not None:
+            path = Path(path).with_suffix('.csv')
+            lat_file = open(path, 'w')
+            lat_file.write('trace,latencies\n')
+            if decimate is not None:
+                trace_file = open(path.with_name(f"{path.stem}_traces.csv"), 'w')
+
+        traces = []
+        latencies = []
+        i = 0
+        try:
+            while n_frames is None or i < n_frames:
+                self._arm_single()
+                if not self._wait_triggered(timeout, poll_interval):
+                    self.logger.warning(f"No trigger within {timeout}s, stopping after {i} frames")
+                    break
+
+                times = np.asarray(self.scope.waveform_time_values_decimal, dtype=float)
+                response = None
+                if decimate is not None:
+                    data = {'time': times[::decimate]}
+                    for chan in self.scope.displayed_channels:
+                        samples = np.asarray(self.scope.get_waveform_samples(chan, mode=mode), dtype=float)
+                        data[f"CH_{chan}"] = samples[::decimate]
+                        if chan == channel:
+                            response = samples
+                    data['trace'] = i
+                    pd.DataFrame(data).to_csv(trace_file, header=(i == 0), index=False)
+                if response is None:
+                    response = np.asarray(self.scope.get_waveform_samples(channel, mode=mode), dtype=float)
+
+                if minmax_:
+                    response = (response - np.nanmin(response)) / (np.nanmax(response) - np.nanmin(response))
+
+                latency = first_crossing(times, response, threshold)
+                if lat_file is not None:
+                    lat_file.write(f"{i},{'' if latency is None else latency}\n")
+                    lat_file.flush()
+                else:
+                    traces.append(i)
+                    latencies.append(np.nan if latency is None else latency)
+                i += 1
+
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if lat_file is not None:
+                lat_file.close()
+            if trace_file is not None:
+                trace_file.close()
+
+        if path is not None:
+            return pd.read_csv(path, dtype={'trace': int, 'latencies': float})
+        return pd.DataFrame({'trace': traces, 'latencies': np.asarray(latencies, dtype=float)})
+
+    def _arm_single(self):
+        """
+        Arm a single-shot trigger, and block with ``*OPC?`` until the scope has processed it so
+        that any ``STOP`` status read afterwards means the acquisition has finished
+        """
+        self.scope.write(":SINGle")
+        self.scope.query("*OPC?")
+
+    def _wait_triggered(self, timeout:float, poll_interval:float) -> bool:
+        """
+        After :meth:`._arm_single`, wait for the scope to finish acquiring (status ``STOP``).
+
+        The acquisition may finish before the first poll, so this doesn't rely on seeing
+        the scope in any intermediate (``WAIT``, ``TD``) state.
+        """
+        start = time.monotonic()
+        while time.monotonic() - start < timeout:
+            if self.scope.query(":TRIGger:STATus?").strip() == 'STOP':
+                return True
+            time.sleep(poll_interval)
+        return False
+
+
+class SimulatedDS1054Z:
+    """
+    Stand-in for :class:`ds1054z.DS1054Z` to exercise :class:`.DS1054Z` without a scope.
+
+    Each ``:SINGle`` acquires a frame with a step on ``CHAN1`` at a random latency after
+    the trigger (time = 0) plus gaussian noise. Only implements the parts of the ds1054z
+    API that :class:`.DS1054Z` uses.
+
+    Args:
+        latency (float): Mean latency of the step, in seconds
+        jitter (float): Standard deviation of the latency, in seconds
+        noise (float): Standard deviation of noise added to each sample
+        n_samples (int): Samples per waveform
+        timebase (tuple[float, float]): Start and end time of each waveform relative to the trigger, in seconds
+        n_frames (int): Number of frames in the simulated recording memory, for :meth:`.DS1054Z.save_traces`
+        polls_to_trigger (int): Number of ``:TRIGger:STATus?`` polls after arming before the frame
+            is acquired. If ``0``, the frame is acquired before the first poll, like a short timebase
+            on a real scope polled over the network.
+        seed (int): Seed for the random number generator
+    """
+
+    def __init__(self,
+                 latency:float=0.001,
+                 jitter:float=0.0001,
+                 noise:float=0.05,
+                 n_samples:int=1200,
+                 timebase:typing.Tuple[float, float]=(-0.001, 0.005),
+                 n_frames:int=10,
+                 polls_to_trigger:int=2,
+                 seed:typing.Optional[int]=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.noise = noise
+        self.n_frames = n_frames
+        self.displayed_channels = ['CHAN1', 'CHAN2']
+        self.waveform_time_values_decimal = np.linspace(timebase[0], timebase[1], n_samples)
+        self.rng = np.random.default_rng(seed)
+        self.latencies = []
+        """Latencies of each acquired frame, for comparing against what was extracted"""
+        self.polls_to_trigger = polls_to_trigger
+        self._status = 'STOP'
+        self._polls_left = 0
+        self._frame = {}
+
+    def _acquire(self):
+        times = self.waveform_time_values_decimal
+        latency = self.rng.normal(self.latency, self.jitter)
+        self.latencies.append(latency)
+        self._frame = {
+            'CHAN1': (times >= latency).astype(float),
+            'CHAN2': (times >= 0).astype(float)
+        }
+        for chan, samples in self._frame.items():
+            samples += self.rng.normal(0, self.noise, samples.shape)
+
+    def write(self, cmd:str):
+        if cmd == ':SINGle':
+            self._polls_left = self.polls_to_trigger
+            if self._polls_left <= 0:
+                self._acquire()
+                self._status = 'STOP'
+            else:
+                self._status = 'WAIT'
+        elif cmd.startswith(':FUNCtion:WREPlay:FCURrent'):
+            self._acquire()
+
+    def query(self, cmd:str) -> str:
+        if cmd == ':TRIGger:STATus?':
+            if self._status != 'STOP':
+                self._polls_left -= 1
+                if self._polls_left <= 0:
+                    self._acquire()
+                    self._status = 'STOP'
+                else:
+                    self._status = 'TD'
+            return self._status
+        elif cmd == '*OPC?':
+            return '1'
+        elif cmd == ':FUNCtion:WREPlay:FSTart?':
+            return '1'
+        elif cmd == ':FUNCtion:WREPlay:FEND?':
+            return str(self.n_frames)
+        raise ValueError(f"Unsupported SCPI query {cmd}")
+
+    def get_waveform_samples(self, channel:str, mode:str="NORM") -> np.ndarray:
+        if not self._frame:
+            self._acquire()
+        return self._frame[channel].copy()
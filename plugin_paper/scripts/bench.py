@@ -0,0 +1,562 @@
+"""
+Run the plugin's benchmarks with consistent warmup, repetition, and isolation,
+and compare them against a stored baseline.
+
+Benchmarks are registered with :func:`.benchmark` as context managers that do any
+setup, yield a function to time, and then clean up. Benchmarks whose dependencies
+(hardware, jackd, etc.) aren't available raise :class:`.Skipped` and are skipped,
+any other error fails the run.
+
+Run from the command line::
+
+    # list benchmarks
+    python -m plugin_paper.scripts.bench --list
+    # run the analysis benchmarks and store them as a baseline
+    python -m plugin_paper.scripts.bench -w 'analysis.*' --save-baseline baseline.json
+    # run them again and exit with status 1 if any got slower
+    python -m plugin_paper.scripts.bench -w 'analysis.*' --baseline baseline.json
+"""
+
+import argparse
+import fnmatch
+import gc
+import importlib
+import json
+import shutil
+import subprocess
+import sys
+import time
+import typing
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from plugin_paper.scripts.helpers import Result, Results
+
+class Skipped(Exception):
+    """A benchmark's dependencies (hardware, jackd, autopilot modules) aren't available in this environment"""
+
+
+BENCHMARKS = {} # type: typing.Dict[str, typing.Callable[[], typing.ContextManager[typing.Callable[[], None]]]]
+"""
+Registered benchmarks, see :func:`.benchmark`
+"""
+
+SELF_TIMED = set() # type: typing.Set[str]
+"""
+Names of benchmarks that measure their own time, see :func:`.benchmark`
+"""
+
+
+def benchmark(name:str, self_timed:bool=False):
+    """
+    Register a benchmark. Decorates a generator that does setup, yields the function to be timed,
+    and then does teardown. If ``self_timed``, the yielded function must return its own
+    measured time (in ns) as an int, which is used instead of the time the call took::
+
+        @benchmark('gpio.write')
+        def gpio_write():
+            pin = Digital_Out(...)
+            try:
+                yield lambda: pin.set(True)
+            finally:
+                pin.release()
+
+    Benchmarks should raise :class:`.Skipped` (eg. with :func:`.require`) when a dependency
+    isn't available. Any other exception is treated as a failure.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = contextmanager(func)
+        if self_timed:
+            SELF_TIMED.add(name)
+        return func
+    return decorator
+
+
+def require(module:str):
+    """Import an external module, raising :class:`.Skipped` if it isn't installed"""
+    try:
+        return importlib.import_module(module)
+    except ImportError as e:
+        raise Skipped(f"{module} is not available: {e}") from e
+
+
+def _pin_conf(name:str='digi_out') -> dict:
+    """Get a pin configuration from prefs, raising :class:`.Skipped` if there isn't one"""
+    prefs = require('autopilot.prefs')
+    try:
+        return prefs.get('HARDWARE')['GPIO'][name]
+    except (KeyError, TypeError) as e:
+        raise Skipped(f"No GPIO {name} configured in prefs") from e
+
+
+# --------------------------------------------------
+# Benchmarks
+# --------------------------------------------------
+
+def _toggle(pin, set_kwargs:typing.Optional[dict]=None) -> typing.Callable[[], None]:
+    state = [True]
+    if set_kwargs is None:
+        set_kwargs = {}
+
+    def run():
+        pin.set(state[0], **set_kwargs)
+        state[0] = not state[0]
+    return run
+
+
+@benchmark('gpio.write')
+def gpio_write():
+    gpio = require('autopilot.hardware.gpio')
+    pin = gpio.Digital_Out(**_pin_conf())
+    try:
+        yield _toggle(pin, {'result': True})
+    finally:
+        pin.release()
+
+
+@benchmark('gpio.write_noresult')
+def gpio_write_noresult():
+    gpio = require('autopilot.hardware.gpio')
+    pin = gpio.Digital_Out(**_pin_conf())
+    try:
+        yield _toggle(pin, {'result': False})
+    finally:
+        pin.release()
+
+
+@benchmark('gpio.write_zero')
+def gpio_write_zero():
+    require('gpiozero')
+    require('autopilot.hardware')
+    from plugin_paper.hardware.zero import Digital_Out_Zero
+    pin = Digital_Out_Zero(**_pin_conf())
+    try:
+        yield _toggle(pin)
+    finally:
+        pin.release()
+
+
+@benchmark('sound.buffer')
+def sound_buffer():
+    """Time to buffer a tone like :func:`.test_sound.test_sound` does between each trial"""
+    sounds = require('autopilot.stim.sound.sounds')
+    if shutil.which('jackd') is None:
+        raise Skipped("jackd is not installed")
+    from plugin_paper.scripts.test_sound import start_jack_server
+    jackd_proc, server = start_jack_server()
+    try:
+        tone = sounds.Tone(10000, duration=100, amplitude=0.1)
+        yield tone.buffer
+    finally:
+        server.quit()
+        jackd_proc.kill()
+
+
+@benchmark('network.serialize')
+def network_serialize():
+    """Serialize a ``CALL`` message like the ones :class:`.Network_Latency` sends"""
+    Message = require('autopilot.networking').Message
+    def run():
+        msg = Message(to='follower', key='CALL', value={'message_number': 0},
+                      sender='leader', id='leader_0', flags={'NOREPEAT': True})
+        msg.serialize()
+    yield run
+
+
+@benchmark('network.deserialize')
+def network_deserialize():
+    """Deserialize a ``RESPONSE`` message like the ones :class:`.Network_Latency` receives"""
+    from datetime import datetime
+    Message = require('autopilot.networking').Message
+    serialized = Message(to='leader', key='RESPONSE',
+                         value={'recv_time': datetime.now().isoformat(), 'message_number': 0},
+                         sender='follower', id='follower_0', flags={'NOREPEAT': True}).serialize()
+    yield lambda: Message(serialized, expand_arrays=True)
+
+
+def _synthetic_traces():
+    from plugin_paper.analysis.synthetic import make_traces
+    traces, _ = make_traces(rng=np.random.default_rng(0))
+    traces['recording'] = 0
+    return traces
+
+
+@benchmark('analysis.combine_traces')
+def analysis_combine_traces():
+    import tempfile
+    from plugin_paper.analysis.combine_traces import combine_traces
+    from plugin_paper.analysis.synthetic import write_traces
+    with tempfile.TemporaryDirectory() as tmpdir:
+        write_traces(tmpdir, n_recordings=4, seed=0)
+        yield lambda: combine_traces(tmpdir)
+
+
+@benchmark('analysis.minmax')
+def analysis_minmax():
+    from plugin_paper.analysis.latency import minmax
+    traces = _synthetic_traces()
+    yield lambda: minmax(traces, 'CH_CHAN1', inplace=False)
+
+
+@benchmark('analysis.extract_latencies')
+def analysis_extract_latencies():
+    from plugin_paper.analysis.latency import extract_latencies
+    traces = _synthetic_traces()
+    yield lambda: extract_latencies(traces, minmax_=True)
+
+
+def import_time(module:str) -> int:
+    """
+    Cumulative time (in ns) to import a module in a fresh interpreter, from ``python -X importtime``
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        capture_output=True, text=True, check=True
+    )
+    # lines look like "import time:       self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module:
+            return int(cumulative) * 1000
+    raise ValueError(f"Could not find {module} in import times")
+
+
+@benchmark('startup.test_gpio', self_timed=True)
+def startup_test_gpio():
+    yield lambda: import_time('plugin_paper.scripts.test_gpio')
+
+
+@benchmark('startup.test_sound', self_timed=True)
+def startup_test_sound():
+    yield lambda: import_time('plugin_paper.scripts.test_sound')
+
+
+# --------------------------------------------------
+# Running
+# --------------------------------------------------
+
+def run_benchmark(name:str, repeat:int=100, warmup:int=10, number:int=1) -> Result:
+    """
+    Run a single benchmark.
+
+    Setup happens outside of timing, then the benchmark is called ``warmup`` times
+    untimed, then ``repeat`` times timed. Garbage collection is disabled while timing.
+
+    Args:
+        name (str): Name of benchmark in :data:`.BENCHMARKS`
+        repeat (int): Number of timed repetitions
+        warmup (int): Number of untimed calls before timing
+        number (int): Number of calls within each timed repetition, for very fast benchmarks.
+            Times are per-call averages within each repetition.
+            Ignored for self-timed benchmarks.
+
+    Returns:
+        :class:`.Result` with the time of each repetition, in ns
+
+    Raises:
+        :class:`.Skipped`: if the benchmark's dependencies aren't available
+    """
+    self_timed = name in SELF_TIMED
+    context = BENCHMARKS[name]()
+    run = context.__enter__()
+
+    times = []
+    gc_was_enabled = gc.isenabled()
+    try:
+        for _ in range(warmup):
+            run()
+
+        gc.collect()
+        gc.disable()
+        for _ in range(repeat):
+            start = time.perf_counter_ns()
+            measured = run()
+            if self_timed:
+                if type(measured) is not int:
+                    raise TypeError(f"Self-timed benchmark {name} returned {measured!r}, not a time in ns")
+                times.append(measured)
+                continue
+            for _ in range(number - 1):
+                run()
+            times.append((time.perf_counter_ns() - start) // number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+        context.__exit__(*sys.exc_info())
+
+    return Result(times=times, test=name)
+
+
+def run_isolated(name:str, repeat:int=100, warmup:int=10, number:int=1) -> Result:
+    """
+    Run a benchmark in a fresh interpreter so state from other benchmarks
+    (imports, allocations, hardware objects) can't affect it
+    """
+    proc = subprocess.run(
+        [sys.executable, '-m', 'plugin_paper.scripts.bench', '--child', name,
+         '-r', str(repeat), '--warmup', str(warmup), '-n', str(number)],
+        capture_output=True, text=True
+    )
+    if proc.returncode == 2:
+        raise Skipped(proc.stderr.strip().splitlines()[-1])
+    elif proc.returncode != 0:
+        raise RuntimeError(f"Benchmark {name} failed:\n{proc.stderr}")
+    return Result(**json.loads(proc.stdout.strip().splitlines()[-1]))
+
+
+def mannwhitneyu(x:np.ndarray, y:np.ndarray) -> typing.Tuple[float, float]:
+    """
+    One-sided Mann-Whitney U test that ``x`` tends to be greater than ``y``,
+    using the normal approximation with tie correction.
+
+    Returns:
+        tuple(float, float): U statistic for ``x`` and p value
+    """
+    from math import erfc, sqrt
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n1, n2 = x.shape[0], y.shape[0]
+    combined = np.concatenate([x, y])
+
+    # average ranks for ties
+    order = np.argsort(combined, kind='mergesort')
+    sorted_vals = combined[order]
+    _, starts, counts = np.unique(sorted_vals, return_index=True, return_counts=True)
+    ranks_sorted = np.repeat(starts + (counts + 1) / 2, counts)
+    ranks = np.empty_like(ranks_sorted)
+    ranks[order] = ranks_sorted
+
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    tie_term = np.sum(counts**3 - counts) / (n * (n - 1))
+    sigma = sqrt(n1 * n2 / 12 * ((n + 1) - tie_term))
+    if sigma == 0:
+        return float(u), 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return float(u), 0.5 * erfc(z / sqrt(2))
+
+
+@dataclass
+class Comparison:
+    """Comparison of a benchmark against its baseline"""
+    test: str
+    baseline_median: float
+    median: float
+    p: float
+    regression: bool
+
+    @property
+    def ratio(self) -> float:
+        return self.median / self.baseline_median
+
+    def __str__(self) -> str:
+        flag = "REGRESSION" if self.regression else "ok"
+        return (f"{self.test}: {self.baseline_median/1000:.3f}us -> {self.median/1000:.3f}us "
+                f"({(self.ratio-1)*100:+.1f}%, p={self.p:.3g}) {flag}")
+
+
+def compare(results:Results, baseline:typing.List[dict], alpha:float=0.01, threshold:float=0.05) -> typing.List[Comparison]:
+    """
+    Compare results against a baseline (the output of :meth:`.Results.dict`).
+
+    A benchmark is a regression if it is significantly slower by a one-sided
+    Mann-Whitney U test (``p < alpha``) *and* its median is more than ``threshold``
+    (proportionally) slower, so that tiny but consistent differences don't fail a run.
+    """
+    baseline_times = {b['test']: b['times'] for b in baseline}
+    comparisons = []
+    for result in results.results:
+        if result.test not in baseline_times:
+            continue
+        base = baseline_times[result.test]
+        _, p = mannwhitneyu(result.times, base)
+        base_median = float(np.median(base))
+        median = float(np.median(result.times))
+        comparisons.append(Comparison(
+            test=result.test,
+            baseline_median=base_median,
+            median=median,
+            p=p,
+            regression=bool(p < alpha and median > base_median * (1 + threshold))
+        ))
+    return comparisons
+
+
+def missing(results:Results, baseline:typing.List[dict], patterns:typing.Optional[typing.List[str]]=None) -> typing.List[str]:
+    """
+    Tests in the baseline (optionally only those matching glob ``patterns``) that have no result in this run
+    """
+    ran = {result.test for result in results.results}
+    tests = [b['test'] for b in baseline if not b['test'].startswith('phase:')]
+    if patterns:
+        tests = [t for t in tests if any(fnmatch.fnmatch(t, pattern) for pattern in patterns)]
+    return [t for t in tests if t not in ran]
+
+
+def output_path(path:typing.Optional[Path]=None) -> Path:
+    """
+    Where to write results: ``path`` if given, otherwise ``DATADIR`` from autopilot's prefs,
+    or the current directory if prefs can't be imported or ``DATADIR`` doesn't exist
+    """
+    if path:
+        return Path(path)
+    name = f"tests-bench-{datetime.now().strftime('%y%m%dT%H%M%S')}.json"
+    try:
+        from autopilot import prefs
+        datadir = Path(prefs.get('DATADIR'))
+    except (ImportError, TypeError):
+        # not installed, or DATADIR not set
+        datadir = None
+    if datadir is None or not datadir.is_dir():
+        datadir = Path.cwd()
+    return datadir / name
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        "Run plugin benchmarks and compare against a baseline")
+    parser.add_argument(
+        '-l', '--list', help="List available benchmarks",
+        action='store_true', required=False
+    )
+    parser.add_argument(
+        '-w', '--which', help="Benchmarks to run, as glob patterns (eg. 'analysis.*'). Otherwise run all",
+        type=str, nargs='+', required=False
+    )
+    parser.add_argument(
+        '-r', '--repeat', help="Number of timed repetitions of each benchmark",
+        type=int, default=100, required=False
+    )
+    parser.add_argument(
+        '--warmup', help="Number of untimed calls before timing",
+        type=int, default=10, required=False
+    )
+    parser.add_argument(
+        '-n', '--number', help="Number of calls within each timed repetition",
+        type=int, default=1, required=False
+    )
+    parser.add_argument(
+        '--isolate', help="Run each benchmark in a separate process",
+        action='store_true', required=False
+    )
+    parser.add_argument(
+        '-b', '--baseline', help="Results .json file to compare against",
+        type=Path, required=False
+    )
+    parser.add_argument(
+        '--save-baseline', help="Save results as a baseline to this path",
+        type=Path, required=False
+    )
+    parser.add_argument(
+        '--allow-skips', help="Don't fail when benchmarks in the baseline were skipped",
+        action='store_true', required=False
+    )
+    parser.add_argument(
+        '--alpha', help="Significance level for regressions",
+        type=float, default=0.01, required=False
+    )
+    parser.add_argument(
+        '--threshold', help="Minimum proportional slowdown of the median to count as a regression",
+        type=float, default=0.05, required=False
+    )
+    parser.add_argument(
+        '-o', '--output', help="Where to write results .json, otherwise in DATADIR, or the current directory without autopilot",
+        type=Path, required=False
+    )
+    parser.add_argument(
+        '--analysis-suite', help="Run the analysis pipeline on synthetic traces and report throughput, "
+                                 "peak memory, and accuracy of each stage",
+        action='store_true', required=False
+    )
+    parser.add_argument(
+        '--miss-rate', help="With --analysis-suite, proportion of synthetic traces with no response. "
+                            "Latencies are only normalized with minmax when there are no misses",
+        type=float, default=0, required=False
+    )
+    parser.add_argument(
+        '--child', help=argparse.SUPPRESS, type=str, required=False
+    )
+    return parser
+
+
+def main(argv:typing.Optional[typing.List[str]]=None) -> int:
+    parser = make_parser()
+    args = parser.parse_args(argv)
+
+    if args.child:
+        try:
+            result = run_benchmark(args.child, args.repeat, args.warmup, args.number)
+        except Skipped as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        print(json.dumps({'times': result.times, 'test': result.test}))
+        return 0
+
+    if args.analysis_suite:
+        from plugin_paper.analysis.benchmark import benchmark_pipeline
+        stages, accuracy = benchmark_pipeline(repeat=args.repeat, miss_rate=args.miss_rate)
+        print(stages.to_string(index=False))
+        print(", ".join(f"{k}: {v}" for k, v in accuracy.items()))
+        if args.output:
+            stages.to_csv(args.output, index=False)
+        if accuracy['n_correct'] < accuracy['n']:
+            return 1
+        return 0
+
+    names = list(BENCHMARKS.keys())
+    if args.which:
+        names = [n for n in names if any(fnmatch.fnmatch(n, pattern) for pattern in args.which)]
+
+    if args.list:
+        for name in names:
+            print(name)
+        return 0
+
+    runner = run_isolated if args.isolate else run_benchmark
+    results = Results(tests='bench')
+    for name in names:
+        try:
+            result = runner(name, args.repeat, args.warmup, args.number)
+        except Skipped as e:
+            print(f"{name}: skipped ({e})")
+            continue
+        results.append(result)
+        print(f"{name}: median {np.median(result.times)/1000:.3f}us over {len(result.times)} reps")
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as bfile:
+            baseline = json.load(bfile)
+        comparisons = compare(results, baseline, alpha=args.alpha, threshold=args.threshold)
+        for comparison in comparisons:
+            print(comparison)
+        not_run = missing(results, baseline, args.which)
+        for test in not_run:
+            print(f"{test}: in baseline but not run")
+        if any(c.regression for c in comparisons) or (not_run and not args.allow_skips):
+            status = 1
+
+    # a failed write shouldn't hide a regression, so results are written after comparing
+    outputs = [(output_path(args.output), "Wrote results to")]
+    if args.save_baseline:
+        outputs.append((args.save_baseline, "Saved baseline to"))
+    for path, message in outputs:
+        try:
+            results.write(path)
+            print(f"{message} {str(path)}")
+        except OSError as e:
+            print(f"Could not write results to {str(path)}: {e}", file=sys.stderr)
+            status = status or 1
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,9 @@
 from dataclasses import dataclass, field
 import typing
-import numpy as np
 from pathlib import Path
 from datetime import datetime
-from autopilot import prefs
 import json
+from plugin_paper.timing import Timer
 
 @dataclass
 class Result:
@@ -24,10 +23,12 @@ class Result:
 
     @property
     def mean(self) -> float:
+        import numpy as np
         return float(np.mean(self.times))
 
     @property
     def std(self) -> float:
+        import numpy as np
         return float(np.std(self.times))
 
     def dict(self) -> dict:
@@ -40,6 +41,8 @@ class Result:
         }
 
     def __str__(self) -> str:
+        # numpy is imported lazily so scripts can parse args and list tests without waiting for it
+        import numpy as np
         topsep = "="*40 + "\n"
         midsep = '-'*40 + "\n"
         return topsep + \
@@ -55,15 +58,27 @@ class Result:
 class Results:
     tests: str
     results: typing.Optional[typing.List[Result]] = field(default_factory=list)
+    timer: Timer = field(default_factory=Timer)
+    """
+    Timing of each phase of the tests, written alongside results as tests named ``phase:{name}``
+    """
 
     def append(self, result:Result):
         self.results.append(result)
 
+    def span(self, name:str):
+        """Shorthand for :meth:`.Timer.span`"""
+        return self.timer.span(name)
+
+    def phases(self) -> typing.List[Result]:
+        return [Result(times=times, test=f"phase:{name}") for name, times in self.timer.spans.items()]
+
     def dict(self) -> typing.List[dict]:
-        return [r.dict() for r in self.results]
+        return [r.dict() for r in self.results + self.phases()]
 
     def write(self, path:typing.Optional[Path]=None):
         if not path:
+            from autopilot import prefs
             path = Path(prefs.get('DATADIR')) / f"tests-{self.tests}-{datetime.now().strftime('%y%m%dT%H%M%S')}.json"
 
         with open(path, 'w') as jpath:
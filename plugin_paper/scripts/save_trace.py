@@ -1,25 +1,35 @@
 from pathlib import Path
 import subprocess
+import typing
 import pandas as pd
 from ds1054z import DS1054Z
+from plugin_paper.scripts.helpers import Results
+from plugin_paper.timing import Timer
 
 
-def save_trace(ip:str, path:Path=Path('.'), base_name:str="OscTrace", mode:str="NORM"):
+def save_trace(ip:str, path:Path=Path('.'), base_name:str="OscTrace", mode:str="NORM",
+               timer:typing.Optional[Timer]=None):
+    if timer is None:
+        timer = Timer()
+
     # check for files in current directory
-    current_files = list(path.glob('*.csv'))
-    trace_n = 0
-    if len(current_files)>0:
-        trace_n = int(current_files[-1].stem.split('_')[-1]) + 1
+    with timer.span("find_files"):
+        current_files = list(path.glob('*.csv'))
+        trace_n = 0
+        if len(current_files)>0:
+            trace_n = int(current_files[-1].stem.split('_')[-1]) + 1
 
-    out_fn = f"{base_name}_{trace_n}.txt"
+        out_fn = f"{base_name}_{trace_n}.txt"
 
-    subprocess.run(['ds1054z', 'save-data', '--filename', out_fn, '--mode', mode, ip])
+    with timer.span("save"):
+        subprocess.run(['ds1054z', 'save-data', '--filename', out_fn, '--mode', mode, ip])
 
 def save_all_traces(
         ip:str,
         path:Path=Path('.'),
         base_name:str="OscTrace",
-        mode:str="NORM") -> pd.DataFrame:
+        mode:str="NORM",
+        timer:typing.Optional[Timer]=None) -> pd.DataFrame:
     """
     Save all traces recorded in the DS1054Z's recording memory
 
@@ -33,39 +43,48 @@ def save_all_traces(
             * ``"NORM"`` - just traces on screen
             * ``"RAW"`` - full trace from memory (takes longer)
             * ``"MAX"`` - Tries to get RAW if possible, otherwise NORM
+        timer (:class:`~plugin_paper.timing.Timer`): Optional: Timer to record time spent connecting,
+            reading frames, and writing the .csv
 
     Returns:
         (:class:`pandas.DataFrame`): A dataframe with timestamps (in seconds),
             voltages per channel, and a trace index.
     """
-    osc = DS1054Z(ip)
-    start_frame = int(osc.query(":FUNCtion:WREPlay:FSTart?"))
-    end_frame = int(osc.query(":FUNCtion:WREPlay:FEND?"))
+    if timer is None:
+        timer = Timer()
+
+    with timer.span("connect"):
+        osc = DS1054Z(ip)
+        start_frame = int(osc.query(":FUNCtion:WREPlay:FSTart?"))
+        end_frame = int(osc.query(":FUNCtion:WREPlay:FEND?"))
 
     traces = []
-    for i in range(start_frame, end_frame+1):
-        # Move to next trace
-        osc.write(f":FUNCtion:WREPlay:FCURrent {i}")
-
-        # Get each displayed channel's samples and timestamps
-        data = {}
-        data['time'] = osc.waveform_time_values_decimal
-        for channel in osc.displayed_channels:
-            data[f"CH_{channel}"] = osc.get_waveform_samples(channel, mode=mode)
-        data["trace"] = i
-        traces.append(pd.DataFrame(data))
+    with timer.span("frames"):
+        for i in range(start_frame, end_frame+1):
+            # Move to next trace
+            osc.write(f":FUNCtion:WREPlay:FCURrent {i}")
+
+            # Get each displayed channel's samples and timestamps
+            data = {}
+            data['time'] = osc.waveform_time_values_decimal
+            for channel in osc.displayed_channels:
+                data[f"CH_{channel}"] = osc.get_waveform_samples(channel, mode=mode)
+            data["trace"] = i
+            traces.append(pd.DataFrame(data))
 
     # concat all dataframes
-    dfs = pd.concat(traces, ignore_index=True)
+    with timer.span("concat"):
+        dfs = pd.concat(traces, ignore_index=True)
 
     # get a filename that increments in number based on existing files in directory
     try:
-        path = Path(path)
-        current_files = list(path.glob(f'{base_name}*.csv'))
-        trace_n = len(current_files)
+        with timer.span("write"):
+            path = Path(path)
+            current_files = list(path.glob(f'{base_name}*.csv'))
+            trace_n = len(current_files)
 
-        out_fn = path / f"{base_name}_{trace_n}.csv"
-        dfs.to_csv(out_fn, index=False)
+            out_fn = path / f"{base_name}_{trace_n}.csv"
+            dfs.to_csv(out_fn, index=False)
     except Exception as e:
         raise RuntimeError(f"Could not save traces, got exception:\n{e}")
     return dfs
@@ -76,4 +95,10 @@ def save_all_traces(
 
 if __name__ == "__main__":
     osc_ip = "192.168.0.163"
-    save_trace(osc_ip)
\ No newline at end of file
+    results = Results(tests='trace')
+    try:
+        save_trace(osc_ip, timer=results.timer)
+    finally:
+        path = results.write()
+        print(results.timer)
+        print(f"Wrote phase timing to {str(path)}")
\ No newline at end of file
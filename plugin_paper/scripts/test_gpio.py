@@ -1,37 +1,44 @@
-from autopilot.hardware.gpio import Digital_Out, Digital_In
-from autopilot import prefs
-from plugin_paper.hardware.zero import Digital_Out_Zero
-import numpy as np
+"""
+Test GPIO speed outside of a task/pilot context.
+
+autopilot's hardware modules are imported within each test rather than at module load,
+so parsing arguments and ``--list`` don't have to wait for them.
+"""
+import sys
 import time
-import timeit
 import argparse
 import typing
-from pathlib import Path
 from plugin_paper.scripts.helpers import Result, Results
-from tqdm import tqdm, trange
-import datetime
-import json
+from plugin_paper.timing import Timer
 
 
 
-def test_write(n_reps:int = 10000, result:bool=True, doprint:bool = True, iti:float = 0.001) -> Result:
-    # get the configuration for our output pin from prefs.json
-    pin_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
-    pin = Digital_Out(**pin_conf)
-    set_to = True
-    times = []
-    for i in range(n_reps):
-        start_time = time.perf_counter_ns()
-        pin.set(set_to, result)
-        times.append(time.perf_counter_ns() - start_time)
-        set_to = not set_to
-        time.sleep(iti/1000)
+def test_write(n_reps:int = 10000, result:bool=True, doprint:bool = True, iti:float = 0.001,
+               timer:typing.Optional[Timer] = None) -> Result:
+    from autopilot import prefs
+    from autopilot.hardware.gpio import Digital_Out
+    if timer is None:
+        timer = Timer()
 
     if not result:
         test_name = "write_noresult"
     else:
         test_name = "write"
 
+    # get the configuration for our output pin from prefs.json
+    with timer.span(f"{test_name}.init"):
+        pin_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
+        pin = Digital_Out(**pin_conf)
+    set_to = True
+    times = []
+    with timer.span(f"{test_name}.loop"):
+        for i in range(n_reps):
+            start_time = time.perf_counter_ns()
+            pin.set(set_to, result)
+            times.append(time.perf_counter_ns() - start_time)
+            set_to = not set_to
+            time.sleep(iti/1000)
+
     result = Result(times=times, test=test_name)
 
     if doprint:
@@ -40,21 +47,28 @@ def test_write(n_reps:int = 10000, result:bool=True, doprint:bool = True, iti:fl
     return result
 
 
-def test_write_zero(n_reps:int = 10000, doprint:bool = True, iti:float = 0.001) -> Result:
+def test_write_zero(n_reps:int = 10000, doprint:bool = True, iti:float = 0.001,
+                    timer:typing.Optional[Timer] = None) -> Result:
     """Same thing as above but with Digital Out Zero, sorry this isn't more reusable it's just a test!"""
+    from autopilot import prefs
+    from plugin_paper.hardware.zero import Digital_Out_Zero
+    if timer is None:
+        timer = Timer()
+    test_name = "write_zero"
+
     # get the configuration for our output pin from prefs.json
-    pin_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
-    pin = Digital_Out_Zero(**pin_conf)
+    with timer.span(f"{test_name}.init"):
+        pin_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
+        pin = Digital_Out_Zero(**pin_conf)
     set_to = True
     times = []
-    for i in range(n_reps):
-        start_time = time.perf_counter_ns()
-        pin.set(set_to)
-        times.append(time.perf_counter_ns() - start_time)
-        set_to = not set_to
-        time.sleep(iti/1000)
-
-    test_name = "write_zero"
+    with timer.span(f"{test_name}.loop"):
+        for i in range(n_reps):
+            start_time = time.perf_counter_ns()
+            pin.set(set_to)
+            times.append(time.perf_counter_ns() - start_time)
+            set_to = not set_to
+            time.sleep(iti/1000)
 
     result = Result(times=times, test=test_name)
 
@@ -63,12 +77,17 @@ def test_write_zero(n_reps:int = 10000, doprint:bool = True, iti:float = 0.001)
 
     return result
 
-def test_readwrite(runtime:float=60) -> Result:
+def test_readwrite(runtime:float=60, timer:typing.Optional[Timer] = None) -> Result:
     """Test latency from external digital input to digital output"""
-    out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
-    in_conf = prefs.get('HARDWARE')['GPIO']['digi_in']
-    pin_out = Digital_Out(**out_conf)
-    pin_in = Digital_In(**in_conf)
+    from autopilot import prefs
+    from autopilot.hardware.gpio import Digital_Out, Digital_In
+    if timer is None:
+        timer = Timer()
+    with timer.span("readwrite.init"):
+        out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
+        in_conf = prefs.get('HARDWARE')['GPIO']['digi_in']
+        pin_out = Digital_Out(**out_conf)
+        pin_in = Digital_In(**in_conf)
 
     def turn_on_off(*args):
         pin_out.set(True)
@@ -81,20 +100,27 @@ def test_readwrite(runtime:float=60) -> Result:
     pin_out.set(False)
 
     try:
-        time.sleep(runtime)
+        with timer.span("readwrite.loop"):
+            time.sleep(runtime)
     except KeyboardInterrupt:
         pass
     finally:
-        pin_in.release()
-        pin_out.release()
+        with timer.span("readwrite.release"):
+            pin_in.release()
+            pin_out.release()
         return Result([0], test="readwrite")
 
-def test_readwrite_script(runtime:float=60):
+def test_readwrite_script(runtime:float=60, timer:typing.Optional[Timer] = None):
     """Latency from input to output using pigpio scripts"""
-    out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
-    in_conf = prefs.get('HARDWARE')['GPIO']['digi_in']
-    pin_out = Digital_Out(**out_conf)
-    pin_in = Digital_In(**in_conf)
+    from autopilot import prefs
+    from autopilot.hardware.gpio import Digital_Out, Digital_In
+    if timer is None:
+        timer = Timer()
+    with timer.span("readwrite_script.init"):
+        out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
+        in_conf = prefs.get('HARDWARE')['GPIO']['digi_in']
+        pin_out = Digital_Out(**out_conf)
+        pin_in = Digital_In(**in_conf)
 
     script = " ".join([
         "tag 999",
@@ -108,31 +134,63 @@ def test_readwrite_script(runtime:float=60):
     ])
 
     try:
-        script_id = pin_out.pig.store_script(script)
-        pin_out.pig.run_script(script_id)
-        time.sleep(runtime)
+        with timer.span("readwrite_script.store"):
+            script_id = pin_out.pig.store_script(script)
+        with timer.span("readwrite_script.loop"):
+            pin_out.pig.run_script(script_id)
+            time.sleep(runtime)
     finally:
-        pin_out.pig.stop_script(script_id)
-        pin_out.release()
-        pin_in.release()
+        with timer.span("readwrite_script.release"):
+            pin_out.pig.stop_script(script_id)
+            pin_out.release()
+            pin_in.release()
 
     return Result([0], test="readwrite_script")
 
-def test_series_jitter(n_reps=521):
+def test_series_jitter(n_reps=521, timer:typing.Optional[Timer] = None):
     """
     Jitter of a script output
     """
-    out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
-    pin_out = Digital_Out(**out_conf)
+    from autopilot import prefs
+    from autopilot.hardware.gpio import Digital_Out
+    if timer is None:
+        timer = Timer()
+    with timer.span("series_jitter.init"):
+        out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
+        pin_out = Digital_Out(**out_conf)
+
+        # On/Off the output for 5 microseconds
+        pin_out.store_series('open', values=[1,0], durations=[5, 495], unit='us')
+
+    with timer.span("series_jitter.loop"):
+        for i in range(n_reps):
+            pin_out.series('open')
+            time.sleep(0.001)
 
-    # On/Off the output for 5 microseconds
-    pin_out.store_series('open', values=[1,0], durations=[5, 495], unit='us')
+    return Result([0], test="series_jitter")
 
-    for i in range(n_reps):
-        pin_out.series('open')
-        time.sleep(0.001)
 
-    return Result([0], test="series_jitter")
+TESTS = [
+    "test_write",
+    "test_write (no result)",
+    "test_write_zero",
+    "test_readwrite",
+    "test_readwrite_script",
+    "test_series_jitter"
+]
+"""
+Names of tests, in the order they are selected by ``--which``
+"""
+
+PROFILE_SPANS = (
+    "write.init", "write_noresult.init", "write_zero.init",
+    "readwrite.init", "readwrite.release",
+    "readwrite_script.init", "readwrite_script.store", "readwrite_script.release",
+    "series_jitter.init"
+)
+"""
+Spans run under the profiler with ``--profile``. The ``*.loop`` spans are what's being measured, so aren't profiled.
+"""
 
 
 def make_parser() -> argparse.ArgumentParser:
@@ -156,6 +214,14 @@ def make_parser() -> argparse.ArgumentParser:
         '-t', '--time', help="How long to run the readwrite test (seconds)",
         type=float, required=False, default=60
     )
+    parser.add_argument(
+        '-p', '--profile', help="Run each phase outside of the measured loop under a sampling profiler (requires pyinstrument)",
+        action='store_true', required=False
+    )
+    parser.add_argument(
+        '-l', '--list', help="List available tests",
+        action='store_true', required=False
+    )
     return parser
 
 
@@ -163,15 +229,21 @@ if __name__ == "__main__":
     parser = make_parser()
     args = parser.parse_args()
 
-    results = Results(tests='gpio')
+    if args.list:
+        for i, test in enumerate(TESTS):
+            print(f"{i}: {test}")
+        sys.exit(0)
+
+    results = Results(tests='gpio', timer=Timer(profile=PROFILE_SPANS if args.profile else None))
+    timer = results.timer
 
     tests = [
-        lambda: test_write(n_reps=args.n_reps, result=True, doprint=args.quiet, iti=args.iti),
-        lambda: test_write(n_reps=args.n_reps, result=False, doprint=args.quiet, iti=args.iti),
-        lambda: test_write_zero(n_reps=args.n_reps, doprint=args.quiet, iti=args.iti),
-        lambda: test_readwrite(runtime=args.time),
-        lambda: test_readwrite_script(runtime=args.time),
-        lambda: test_series_jitter(n_reps=args.n_reps)
+        lambda: test_write(n_reps=args.n_reps, result=True, doprint=args.quiet, iti=args.iti, timer=timer),
+        lambda: test_write(n_reps=args.n_reps, result=False, doprint=args.quiet, iti=args.iti, timer=timer),
+        lambda: test_write_zero(n_reps=args.n_reps, doprint=args.quiet, iti=args.iti, timer=timer),
+        lambda: test_readwrite(runtime=args.time, timer=timer),
+        lambda: test_readwrite_script(runtime=args.time, timer=timer),
+        lambda: test_series_jitter(n_reps=args.n_reps, timer=timer)
     ]
 
     if args.which:
@@ -184,3 +256,5 @@ if __name__ == "__main__":
     finally:
         path = results.write()
         print(f"Wrote results to {str(path)}")
+        if args.quiet:
+            print(results.timer)
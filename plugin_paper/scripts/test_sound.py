@@ -1,30 +1,48 @@
 """
 Test sound latency
+
+The jackd client and sound modules are imported when they're needed rather than at
+module load, so ``--list`` doesn't have to wait for them.
 """
 
-from autopilot import external
-from autopilot.stim.sound import jackclient
-from autopilot.stim.sound import sounds
-from autopilot.hardware.gpio import Digital_In, Digital_Out
-from autopilot import prefs
 import time
 import sys
 import argparse
+import typing
+from plugin_paper.scripts.helpers import Results
+from plugin_paper.timing import Timer
 
-def start_jack_server():
-    jackd_process = external.start_jackd()
-    server = jackclient.JackClient(disable_gc=True)
-    server.start()
-    return jackd_process, server
+PROFILE_SPANS = ("jackd.start", "jackclient.start", "sound.init", "sound.buffer", "sound.release", "jackd.stop")
+"""
+Spans run under the profiler with ``--profile``. ``sound.loop`` is what's being measured, so isn't profiled.
+"""
 
-def test_sound(n_reps:int=-1, iti=0.5, duration:float=100):
-    tone = sounds.Tone(10000, duration=duration, amplitude=0.1)
-    tone.buffer()
+def start_jack_server(timer:typing.Optional[Timer]=None):
+    from autopilot import external
+    from autopilot.stim.sound import jackclient
+    if timer is None:
+        timer = Timer()
+    with timer.span("jackd.start"):
+        jackd_process = external.start_jackd()
+    with timer.span("jackclient.start"):
+        server = jackclient.JackClient(disable_gc=True)
+        server.start()
+    return jackd_process, server
 
-    out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
-    in_conf = prefs.get('HARDWARE')['GPIO']['digi_in']
-    pin_out = Digital_Out(**out_conf)
-    pin_in = Digital_In(**in_conf)
+def test_sound(n_reps:int=-1, iti=0.5, duration:float=100, timer:typing.Optional[Timer]=None):
+    from autopilot import prefs
+    from autopilot.stim.sound import sounds
+    from autopilot.hardware.gpio import Digital_In, Digital_Out
+    if timer is None:
+        timer = Timer()
+    with timer.span("sound.init"):
+        tone = sounds.Tone(10000, duration=duration, amplitude=0.1)
+        tone.buffer()
+
+        out_conf = prefs.get('HARDWARE')['GPIO']['digi_out']
+        in_conf = prefs.get('HARDWARE')['GPIO']['digi_in']
+        pin_out = Digital_Out(**out_conf)
+        pin_in = Digital_In(**in_conf)
 
     def play_wrapper(*args):
         tone.play()
@@ -32,23 +50,26 @@ def test_sound(n_reps:int=-1, iti=0.5, duration:float=100):
 
     n_loops = 0
     try:
-        while n_reps < 0 or n_loops < n_reps:
-            # could use pulse but want a longer pulse yno
-            # pin_out.pulse()
-            pin_out.set(True)
-            time.sleep(0.2)
-            tone.stop_evt.wait(5)
-            pin_out.set(False)
-            tone.buffer()
-
-            time.sleep(iti)
-            n_loops += 1
+        with timer.span("sound.loop"):
+            while n_reps < 0 or n_loops < n_reps:
+                # could use pulse but want a longer pulse yno
+                # pin_out.pulse()
+                pin_out.set(True)
+                time.sleep(0.2)
+                tone.stop_evt.wait(5)
+                pin_out.set(False)
+                with timer.span("sound.buffer"):
+                    tone.buffer()
+
+                time.sleep(iti)
+                n_loops += 1
     except KeyboardInterrupt:
         pass
 
     finally:
-        pin_out.release()
-        pin_in.release()
+        with timer.span("sound.release"):
+            pin_out.release()
+            pin_in.release()
 
 
 def make_parser() -> argparse.ArgumentParser:
@@ -69,6 +90,10 @@ def make_parser() -> argparse.ArgumentParser:
         '-l', '--list', help="List available jackd test settings",
         action='store_true', required=False
     )
+    parser.add_argument(
+        '-p', '--profile', help="Run each phase outside of the measured loop under a sampling profiler (requires pyinstrument)",
+        action='store_true', required=False
+    )
     return parser
 
 
@@ -94,13 +119,20 @@ if __name__ == "__main__":
     test = TESTS[args.which]
     print(f'running test {args.which}:\n{test}')
 
+    from autopilot import prefs
     prefs.set('JACKDSTRING', TESTS[args.which])
 
-    jackd_proc, server = start_jack_server()
+    results = Results(tests='sound', timer=Timer(profile=PROFILE_SPANS if args.profile else None))
+
+    jackd_proc, server = start_jack_server(timer=results.timer)
 
     try:
-        test_sound(args.n_reps, args.iti)
+        test_sound(args.n_reps, args.iti, timer=results.timer)
 
     finally:
-        server.quit()
-        jackd_proc.kill()
\ No newline at end of file
+        with results.span("jackd.stop"):
+            server.quit()
+            jackd_proc.kill()
+        path = results.write()
+        print(results.timer)
+        print(f"Wrote phase timing to {str(path)}")
\ No newline at end of file
@@ -1,13 +1,17 @@
 from autopilot.tasks import Task
 from autopilot.data.models.protocol import Trial_Data
-from autopilot.networking import Net_Node
+from autopilot.networking import Net_Node, Message
 from autopilot import prefs
 from pydantic import Field
 from datetime import datetime
 from threading import Event
 from queue import Queue
-from typing import Optional
-from time import sleep
+from typing import Optional, List, Dict, Tuple, Union
+from time import sleep, time_ns
+import os
+import numpy as np
+from plugin_paper.scripts.helpers import Results
+from plugin_paper.timing import Timer
 
 class Network_Latency(Task):
 
@@ -24,6 +28,38 @@ class Network_Latency(Task):
         'tag': 'inter-trial interval, in ms',
         'type': 'float'
     }
+    PARAMS['low_latency'] = {
+        'tag': 'Follower takes an integer ns timestamp as soon as a message is received, before deserializing, and replies with a pre-serialized message',
+        'type': 'bool'
+    }
+    PARAMS['cpu'] = {
+        'tag': "CPU core to pin the follower's listener thread to (-1 to not pin)",
+        'type': 'int'
+    }
+    PARAMS['rt_priority'] = {
+        'tag': "SCHED_FIFO priority (1-99) for the follower's listener thread (0 to not use SCHED_FIFO)",
+        'type': 'int'
+    }
+    PARAMS['compare_modes'] = {
+        'tag': 'Alternate between default and each low latency setting in blocks, and report tail latency for each',
+        'type': 'bool'
+    }
+    PARAMS['block_size'] = {
+        'tag': 'Number of messages in each block when comparing modes',
+        'type': 'int'
+    }
+    PARAMS['sweep'] = {
+        'tag': 'Sweep over payload sizes and types, sending n_messages of each, rather than measuring latency of small messages',
+        'type': 'bool'
+    }
+    PARAMS['payload_sizes'] = {
+        'tag': 'Comma separated payload sizes (in bytes) to sweep over',
+        'type': 'str'
+    }
+    PARAMS['payload_types'] = {
+        'tag': 'Comma separated payload types to sweep over, any of dict, array, array_binary',
+        'type': 'str'
+    }
 
     PLOT = {
         'data': {
@@ -37,11 +73,41 @@ class Network_Latency(Task):
         send_time: datetime = Field(..., description="Timestamp of sending the initial message")
         recv_time: datetime = Field(..., description="Timestamp of when the message was received by the second pi")
         latency: float = Field(..., description="Difference between receive and send time, in ms")
+        mode: str = Field('default', description="Follower mode the message was sent in, see :attr:`.Network_Latency.MODES`")
+        payload_type: Optional[str] = Field(None, description="When sweeping, type of payload, see :attr:`.Network_Latency.PAYLOAD_TYPES`")
+        payload_size: Optional[int] = Field(None, description="When sweeping, size of payload data in bytes")
+        serialize_time: Optional[float] = Field(None, description="When sweeping, time to serialize the message on the leader, in ms")
+        transmit_time: Optional[float] = Field(None, description="When sweeping, time from sending until the follower receives the message, before deserializing, in ms")
+        deserialize_time: Optional[float] = Field(None, description="When sweeping, time to deserialize the message on the follower, in ms")
 
     LEADER_PORT = 5580
     FOLLOWER_PORT = 5581
 
-    def __init__(self, n_messages:int=None, iti:float=5, role:str="leader", leader_ip:str=None, follower_id:str=None, **kwargs):
+    MODES = ('default', 'low_latency', 'pinned', 'fifo')
+    """
+    Follower modes, each adding to the last:
+
+    * ``default`` - Format an isoformat timestamp and send a reply with :meth:`.Net_Node.send`
+    * ``low_latency`` - Take a :func:`time.time_ns` timestamp in the socket's receive callback, before
+      deserializing or dispatching to a listen thread, and reply with a pre-serialized message template
+    * ``pinned`` - Pin the follower's listener thread to ``cpu``
+    * ``fifo`` - Run the follower's listener thread with ``SCHED_FIFO`` at ``rt_priority``
+    """
+
+    PAYLOAD_TYPES = ('dict', 'array', 'array_binary')
+    """
+    Payload types for sweeps:
+
+    * ``dict`` - A dict with a list of floats, serialized as JSON
+    * ``array`` - A float64 numpy array, serialized as base64 within the JSON message by :class:`.Message`
+    * ``array_binary`` - The same array, sent zero-copy as its own zmq frame with a small JSON header
+    """
+
+    def __init__(self, n_messages:int=None, iti:float=5, role:str="leader", leader_ip:str=None, follower_id:str=None,
+                 low_latency:bool=False, cpu:int=-1, rt_priority:int=0, compare_modes:bool=False, block_size:int=100,
+                 sweep:bool=False, payload_sizes:Union[str, List[int]]="8,1024,65536,1048576,4194304",
+                 payload_types:Union[str, List[str]]="dict,array,array_binary",
+                 **kwargs):
         super(Network_Latency, self).__init__(**kwargs)
 
         self.n_messages = int(n_messages)
@@ -56,18 +122,47 @@ class Network_Latency(Task):
         self.response_q = Queue()
         self.iti = iti
         self.start_kwargs = kwargs
+        self.timer = Timer()
+
+        self.low_latency = bool(low_latency)
+        self.cpu = int(cpu)
+        self.rt_priority = int(rt_priority)
+        self.compare_modes = bool(compare_modes)
+        self.block_size = int(block_size)
+        self.mode = 'default'
+        self.latencies = {} # type: Dict[str, List[float]]
+        self.configured = Event()
+        self.configured.clear()
+        self._configured_mode = 'default'
+        self._response_template = None # type: Optional[bytes]
+        self._fast_calls = False
+
+        self.sweep = bool(sweep)
+        if isinstance(payload_sizes, str):
+            payload_sizes = payload_sizes.split(',')
+        self.payload_sizes = [int(size) for size in payload_sizes]
+        if isinstance(payload_types, str):
+            payload_types = payload_types.split(',')
+        self.payload_types = [ptype.strip() for ptype in payload_types]
+        for ptype in self.payload_types:
+            if ptype not in self.PAYLOAD_TYPES:
+                raise ValueError(f"Unknown payload type {ptype}, must be one of {self.PAYLOAD_TYPES}")
+        self.sweep_times = {} # type: Dict[tuple, Dict[str, List[float]]]
 
         self.listens = {
             'READY': self.l_ready,
             'STOP': self.l_stop,
             'CALL': self.l_call,
-            'RESPONSE': self.l_response
+            'RESPONSE': self.l_response,
+            'CONFIGURE': self.l_configure,
+            'CONFIGURED': self.l_configured
         }
 
-        if self.role == 'leader':
-            self.init_leader()
-        else:
-            self.init_follower()
+        with self.timer.span('init'):
+            if self.role == 'leader':
+                self.init_leader()
+            else:
+                self.init_follower()
 
         self.stages = iter([self.volley])
 
@@ -92,6 +187,7 @@ class Network_Latency(Task):
         start_msg['role'] = 'follower'
         start_msg['leader_ip'] = self.node.ip
         start_msg['n_messages'] = self.n_messages
+        start_msg['sweep'] = self.sweep
 
         # send multihop message to start the follower!
         to = ['T', self.follower_id]
@@ -115,6 +211,11 @@ class Network_Latency(Task):
         self.upstream_ip = self.leader_ip
 
         self.node = self.init_networking()
+        self._default_affinity = self._get_affinity()
+        self._response_template = self._make_response_template()
+
+        if self.sweep:
+            self._set_receiver(raw=True)
 
         self.node.send(to='leader', key="READY", value={})
 
@@ -153,6 +254,325 @@ class Network_Latency(Task):
             flags={'NOREPEAT':True})
 
 
+    def _call_fast(self, received:int, message_number:int):
+        """
+        Like :meth:`.l_call`, but with a timestamp taken by :meth:`._handle_frames` as soon
+        as the message was received, filled into a pre-serialized response rather than making a new :class:`.Message`
+        """
+        self.node.sock.send_multipart([
+            self.upstream.encode('utf-8'),
+            b'leader',
+            self._response_template % (received, message_number)
+        ])
+
+    def _make_response_template(self) -> bytes:
+        """
+        Serialize a ``RESPONSE`` message once with placeholders for the receive time and message number
+        """
+        msg = Message(
+            to='leader',
+            key='RESPONSE',
+            value={'recv_ns': '__RECV_NS__', 'message_number': '__MESSAGE_NUMBER__'},
+            sender=self.node.id,
+            id=f"{self.node.id}_response",
+            flags={'NOREPEAT': True}
+        )
+        template = msg.serialize().replace(b'%', b'%%')
+        return template.replace(b'"__RECV_NS__"', b'%d').replace(b'"__MESSAGE_NUMBER__"', b'%d')
+
+    def _get_affinity(self) -> Optional[set]:
+        try:
+            return os.sched_getaffinity(0)
+        except AttributeError:
+            # not on linux
+            return None
+
+    def _set_realtime(self, cpu:int=-1, rt_priority:int=0) -> Tuple[int, int]:
+        """
+        Pin the node's listener thread to ``cpu`` and set its scheduling policy to
+        ``SCHED_FIFO`` at ``rt_priority`` , or reset them if ``-1`` and ``0`` respectively.
+
+        Returns:
+            tuple(int, int): The ``cpu`` and ``rt_priority`` that were actually applied,
+            ``-1`` and ``0`` if setting them failed
+
+        ``CALL`` messages in ``low_latency`` mode are answered from the listener thread itself
+        by :meth:`._handle_frames` , and :meth:`.Net_Node.handle_listen` runs each listen method
+        in a new thread, which inherits the affinity and scheduling policy of the listener thread.
+
+        ``cpu`` should be isolated from the scheduler (eg. with ``isolcpus=`` in ``/boot/cmdline.txt``)
+        for pinning to keep other processes off of it, and ``SCHED_FIFO`` requires root or ``CAP_SYS_NICE``.
+        """
+        tid = self.node.loop_thread.native_id
+        try:
+            if cpu >= 0:
+                os.sched_setaffinity(tid, {cpu})
+            elif self._default_affinity is not None:
+                os.sched_setaffinity(tid, self._default_affinity)
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"Could not pin listener thread to cpu {cpu}, got exception: {e}")
+            cpu = -1
+
+        try:
+            if rt_priority > 0:
+                os.sched_setscheduler(tid, os.SCHED_FIFO, os.sched_param(rt_priority))
+            else:
+                os.sched_setscheduler(tid, os.SCHED_OTHER, os.sched_param(0))
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"Could not set SCHED_FIFO priority {rt_priority} for listener thread, got exception: {e}")
+            rt_priority = 0
+
+        return cpu, rt_priority
+
+    def l_configure(self, msg):
+        """
+        Receive a message from the leader with the mode to use for subsequent calls
+        """
+        self._fast_calls = bool(msg['low_latency'])
+        cpu, rt_priority = self._set_realtime(msg['cpu'], msg['rt_priority'])
+        # report what was actually applied, eg. without CAP_SYS_NICE a fifo block is really low_latency
+        applied = {'low_latency': self._fast_calls, 'cpu': cpu, 'rt_priority': rt_priority}
+        applied['mode'] = self._mode_name(**applied)
+        self.mode = applied['mode']
+
+        # listens run in their own thread, so switch the receive callback from the IOLoop's thread,
+        # and only confirm once it has switched so no calls are received in the wrong mode
+        def switch():
+            self._set_receiver(raw=self._fast_calls or self.sweep)
+            self.node.send(to='leader', key="CONFIGURED", value=applied)
+        self.node.loop.add_callback(switch)
+
+    def l_configured(self, msg):
+        """
+        The follower has switched modes, and reports the settings it actually applied
+        """
+        self._configured_mode = msg['mode']
+        self.configured.set()
+
+    def _mode_name(self, low_latency:bool, cpu:int, rt_priority:int) -> str:
+        """
+        The most specific mode in :attr:`.MODES` that a set of follower settings amounts to
+        """
+        if rt_priority > 0:
+            return 'fifo'
+        elif cpu >= 0:
+            return 'pinned'
+        elif low_latency:
+            return 'low_latency'
+        else:
+            return 'default'
+
+    def _mode_settings(self, mode:str) -> dict:
+        settings = {'mode': mode, 'low_latency': False, 'cpu': -1, 'rt_priority': 0}
+        idx = self.MODES.index(mode)
+        if idx >= 1:
+            settings['low_latency'] = True
+        if idx >= 2:
+            settings['cpu'] = self.cpu
+        if idx >= 3:
+            settings['rt_priority'] = self.rt_priority
+        return settings
+
+    def _modes(self) -> List[str]:
+        """
+        Modes to use in this session. If ``compare_modes``, each mode up to the most
+        specific one configured, otherwise just that one. ``pinned`` is only
+        used if a ``cpu`` is given, otherwise ``fifo`` follows ``low_latency``.
+        """
+        last = self._mode_name(self.low_latency, self.cpu, self.rt_priority)
+
+        if self.compare_modes:
+            modes = [mode for mode in self.MODES[:self.MODES.index(last)+1]
+                     if mode != 'pinned' or self.cpu >= 0]
+            if len(modes) == 1:
+                modes.append('low_latency')
+            return modes
+        else:
+            return [last]
+
+    def configure(self, mode:str):
+        """
+        Tell the follower to switch modes and wait until it has. Latencies are labeled with the
+        mode the follower actually applied, which may be less than ``mode`` if it couldn't pin
+        its thread or use ``SCHED_FIFO``.
+        """
+        self.configured.clear()
+        self.node.send(to='follower', key="CONFIGURE", value=self._mode_settings(mode))
+        self.configured.wait()
+        if self._configured_mode != mode:
+            self.logger.warning(f"Follower could not apply mode {mode}, using {self._configured_mode}")
+        self.mode = self._configured_mode
+
+    def tail_report(self) -> str:
+        """
+        Percentiles of latency for each mode, and how much each reduces the 99th and 99.9th
+        percentile latency compared to the first mode
+        """
+        lines = []
+        base = None
+        for mode, latencies in self.latencies.items():
+            if len(latencies) == 0:
+                continue
+            p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+            line = f"{mode}: n={len(latencies)}, p50={p50:.3f}ms, p99={p99:.3f}ms, p99.9={p999:.3f}ms, max={np.max(latencies):.3f}ms"
+            if base is None:
+                base = (p99, p999)
+            else:
+                line += f" (p99 {(1-p99/base[0])*100:+.1f}%, p99.9 {(1-p999/base[1])*100:+.1f}% reduction)"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def _set_receiver(self, raw:bool):
+        """
+        Receive messages with :meth:`._handle_frames` if ``raw`` , otherwise restore :meth:`.Net_Node.handle_listen` .
+        Must be called from the node's IOLoop thread.
+        """
+        if raw:
+            # receive raw frames so we can timestamp before deserializing
+            self.node.sock.on_recv(self._handle_frames, copy=False)
+        else:
+            self.node.sock.on_recv(self.node.handle_listen)
+
+    def _handle_frames(self, frames:list):
+        """
+        In ``low_latency`` mode and when sweeping, replaces :meth:`.Net_Node.handle_listen` as the
+        socket's receive callback to timestamp messages before they are deserialized or dispatched.
+
+        In ``low_latency`` mode, ``CALL`` messages are answered immediately with :meth:`._call_fast` .
+        When sweeping, deserialization is timed separately, and binary messages are
+        ``[recipient, array, header]`` with the array read without copying.
+        Other messages are handled by :meth:`.Net_Node.handle_listen` .
+        """
+        received = time_ns()
+        if len(frames) == 3:
+            start = time_ns()
+            header = Message(frames[-1].bytes).value
+            payload = np.frombuffer(frames[1].buffer, dtype=header['dtype']).reshape(header['shape'])
+            deserialize_ns = time_ns() - start
+        else:
+            start = time_ns()
+            msg = Message(frames[-1].bytes, expand_arrays=True)
+            deserialize_ns = time_ns() - start
+            if msg.key == 'CALL' and self._fast_calls:
+                self._call_fast(received, msg.value['message_number'])
+                return
+            elif msg.key != 'SWEEP':
+                self.node.handle_listen([frame.bytes for frame in frames])
+                return
+            header = msg.value
+            payload = header['payload']
+            if isinstance(payload, dict):
+                payload = payload['values']
+
+        # report how many values arrived so the leader can check the whole payload was deserialized
+        n_values = len(payload)
+
+        self.node.send(
+            to="leader",
+            key="RESPONSE",
+            value={
+                'recv_ns': received,
+                'deserialize_ns': deserialize_ns,
+                'message_number': header['message_number'],
+                'n_values': n_values
+            },
+            flags={'NOREPEAT': True})
+
+    @staticmethod
+    def make_payload(payload_type:str, size:int, rng:np.random.Generator) -> Union[dict, np.ndarray]:
+        """
+        Make a payload of one of :attr:`.PAYLOAD_TYPES` with ``size`` bytes of float64 data
+        """
+        values = rng.random(max(1, size // 8))
+        if payload_type == 'dict':
+            return {'values': values.tolist()}
+        return values
+
+    def _sweep_volley(self, i:int, subject:str, payload_type:str, size:int, payload:Union[dict, np.ndarray]):
+        flags = {'NOREPEAT': True, 'NOLOG': True}
+
+        start = time_ns()
+        if payload_type == 'array_binary':
+            header = self.node.prepare_message(
+                'follower', 'SWEEP',
+                {'message_number': i, 'dtype': str(payload.dtype), 'shape': payload.shape},
+                repeat=False, flags=flags).serialize()
+        else:
+            msg = self.node.prepare_message(
+                'follower', 'SWEEP', {'message_number': i, 'payload': payload},
+                repeat=False, flags=flags)
+            msg.serialize()
+        serialize_ns = time_ns() - start
+
+        send_ns = time_ns()
+        if payload_type == 'array_binary':
+            self.node.router.send_multipart([b'follower', b'follower', payload, header], copy=False)
+        else:
+            # already serialized, so send just uses the cached message
+            self.node.send(to='follower', msg=msg)
+
+        response = self.response_q.get()
+        if response['message_number'] != i:
+            self.logger.warning(f"Received response out of order? i:{i}, response:{response['message_number']}")
+        n_values = len(payload['values']) if payload_type == 'dict' else payload.size
+        if response['n_values'] != n_values:
+            self.logger.warning(f"Follower deserialized {response['n_values']} values, but {n_values} were sent")
+
+        with self.timer.span('report'):
+            serialize_time = serialize_ns / 1e6
+            transmit_time = (response['recv_ns'] - send_ns) / 1e6
+            deserialize_time = response['deserialize_ns'] / 1e6
+            times = self.sweep_times.setdefault((payload_type, size), {'serialize': [], 'transmit': [], 'deserialize': []})
+            times['serialize'].append(serialize_time)
+            times['transmit'].append(transmit_time)
+            times['deserialize'].append(deserialize_time)
+
+            self.node.send(to='T', key='DATA', value={
+                'send_time': datetime.fromtimestamp(send_ns / 1e9).isoformat(),
+                'recv_time': datetime.fromtimestamp(response['recv_ns'] / 1e9).isoformat(),
+                'latency': serialize_time + transmit_time + deserialize_time,
+                'payload_type': payload_type,
+                'payload_size': size,
+                'serialize_time': serialize_time,
+                'transmit_time': transmit_time,
+                'deserialize_time': deserialize_time,
+                'pilot': prefs.get('NAME'),
+                'trial_num': i,
+                'subject': subject,
+                'TRIAL_END': True,
+            })
+
+    def sweep_volley(self, subject:str):
+        """
+        Send ``n_messages`` of each payload type and size
+        """
+        rng = np.random.default_rng()
+        i = 0
+        for payload_type in self.payload_types:
+            for size in self.payload_sizes:
+                # make payloads before timing
+                payload = self.make_payload(payload_type, size, rng)
+                for _ in range(self.n_messages):
+                    self._sweep_volley(i, subject, payload_type, size, payload)
+                    i += 1
+                    sleep(self.iti/1000)
+
+                    if self.quitting.is_set():
+                        return
+
+    def sweep_report(self) -> str:
+        """
+        Median serialization, transmission, and deserialization time for each payload type and size
+        """
+        lines = []
+        for (payload_type, size), times in self.sweep_times.items():
+            medians = {k: np.median(v) for k, v in times.items()}
+            lines.append(
+                f"{payload_type} {size}B: serialize={medians['serialize']:.3f}ms, "
+                f"transmit={medians['transmit']:.3f}ms, deserialize={medians['deserialize']:.3f}ms"
+            )
+        return "\n".join(lines)
+
     def l_response(self, msg):
         """
         Receive a message from the follower with the timestamp that it received the
@@ -169,7 +589,7 @@ class Network_Latency(Task):
 
     def _volley(self, i:int, subject:str):
 
-        send_time = datetime.now()
+        send_ns = time_ns()
         self.node.send(
             to="follower", 
             key="CALL", 
@@ -181,32 +601,53 @@ class Network_Latency(Task):
             self.logger.warning(f"Received response out of order? i:{i}, response:{response['message_number']}")
 
         # get difference
-        recv_time = datetime.fromisoformat(response['recv_time'])
-        latency = (recv_time - send_time).total_seconds() * 1000
-
-
-        self.node.send(to='T', key='DATA', value={
-            'send_time': send_time.isoformat(),
-            'recv_time': recv_time.isoformat(),
-            'latency': latency,
-            'pilot': prefs.get('NAME'),
-            'trial_num': i,
-            'subject': subject,
-            'TRIAL_END': True,
-        })
+        with self.timer.span('report'):
+            send_time = datetime.fromtimestamp(send_ns / 1e9)
+            if 'recv_ns' in response:
+                recv_time = datetime.fromtimestamp(response['recv_ns'] / 1e9)
+                latency = (response['recv_ns'] - send_ns) / 1e6
+            else:
+                recv_time = datetime.fromisoformat(response['recv_time'])
+                latency = (recv_time - send_time).total_seconds() * 1000
+            self.latencies.setdefault(self.mode, []).append(latency)
+
+
+            self.node.send(to='T', key='DATA', value={
+                'send_time': send_time.isoformat(),
+                'recv_time': recv_time.isoformat(),
+                'latency': latency,
+                'pilot': prefs.get('NAME'),
+                'trial_num': i,
+                'subject': subject,
+                'mode': self.mode,
+                'TRIAL_END': True,
+            })
 
     def volley(self):
 
         subject = prefs.get('SUBJECT')
 
         if self.role == "leader":
-            self.ready_event.wait()
+            with self.timer.span('wait_ready'):
+                self.ready_event.wait()
         else:
             # follower just waits and then returns, all of its actions happen in callbacks
             self.quitting.wait()
             return {}
 
+        if self.sweep:
+            self.sweep_volley(subject)
+            self.node.send(to='follower', key="STOP", value={})
+            self.logger.info(f"Payload sweep:\n{self.sweep_report()}")
+            return
+
+        modes = self._modes()
+        requested = None
         for i in range(self.n_messages):
+            mode = modes[(i // self.block_size) % len(modes)]
+            if mode != requested:
+                self.configure(mode)
+                requested = mode
 
             self._volley(i, subject)
             sleep(self.iti/1000)
@@ -215,9 +656,17 @@ class Network_Latency(Task):
                 break
 
         self.node.send(to='follower', key="STOP", value={})
+        self.logger.info(f"Latency by follower mode:\n{self.tail_report()}")
 
     def end(self):
-        self.node.release()
+        with self.timer.span('release'):
+            self.node.release()
         self.quitting.set()
+        self.logger.info(f"Time spent outside of measured messages:\n{self.timer}")
+        try:
+            path = Results(tests=f"network-{self.role}", timer=self.timer).write()
+            self.logger.info(f"Wrote phase timing to {str(path)}")
+        except Exception as e:
+            self.logger.exception(f"Could not write phase timing, got exception: {e}")
         super(Network_Latency, self).end()
 
@@ -0,0 +1,100 @@
+"""
+Lightweight timing of the phases of a test (setup, hardware init, the measured loop, writing results)
+so that time spent outside of what's being measured can be found.
+
+Use :meth:`.Timer.span` as a context manager around each phase::
+
+    timer = Timer()
+    with timer.span('init'):
+        pin = Digital_Out(**pin_conf)
+    with timer.span('loop'):
+        ...
+    print(timer)
+
+Spans cost two calls to :func:`time.perf_counter_ns`, so shouldn't be put inside the measured loop itself.
+"""
+
+import typing
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter_ns
+
+
+@dataclass
+class Timer:
+    """Collects durations (in ns) of named phases"""
+    spans: typing.Dict[str, typing.List[int]] = field(default_factory=dict)
+    """
+    Durations of each run of each span, in the order they were first entered
+    """
+    profile: typing.Optional[typing.Collection[str]] = None
+    """
+    Names of spans to run under a sampling profiler (`pyinstrument <https://github.com/joerick/pyinstrument>`_ ,
+    which must be installed separately), or ``'all'`` for every span.
+    """
+    profile_dir: typing.Optional[Path] = None
+    """
+    Directory to write profiler reports to as ``profile-{span}.txt``, otherwise kept in :attr:`.profiles`
+    """
+    profiles: typing.Dict[str, str] = field(default_factory=dict)
+    """
+    Text profiler reports for each profiled span
+    """
+    _profiling: bool = field(default=False, init=False, repr=False)
+
+    @contextmanager
+    def span(self, name:str):
+        """Time the enclosed block, adding its duration to :attr:`.spans` under ``name``"""
+        profiler = None
+        # profilers don't nest, so only the outermost profiled span is profiled
+        if not self._profiling and self.profile is not None and (self.profile == 'all' or name in self.profile):
+            profiler = self._start_profiler()
+            self._profiling = True
+
+        start = perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.spans.setdefault(name, []).append(perf_counter_ns() - start)
+            if profiler is not None:
+                self._profiling = False
+                self._stop_profiler(profiler, name)
+
+    @staticmethod
+    def _start_profiler():
+        try:
+            from pyinstrument import Profiler
+        except ImportError as e:
+            raise ImportError("Profiling spans requires pyinstrument, install with pip install pyinstrument") from e
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+
+    def _stop_profiler(self, profiler, name:str):
+        profiler.stop()
+        report = profiler.output_text()
+        self.profiles[name] = report
+        if self.profile_dir is not None:
+            profile_dir = Path(self.profile_dir)
+            profile_dir.mkdir(parents=True, exist_ok=True)
+            with open(profile_dir / f"profile-{name}.txt", 'w') as pfile:
+                pfile.write(report)
+
+    def total(self, name:str) -> int:
+        """Total time spent in a span, in ns"""
+        return sum(self.spans.get(name, []))
+
+    def dict(self) -> typing.Dict[str, dict]:
+        return {
+            name: {'times': times, 'total': sum(times), 'n': len(times)}
+            for name, times in self.spans.items()
+        }
+
+    def __str__(self) -> str:
+        topsep = "="*40 + "\n"
+        lines = [
+            f"{name}: {sum(times)/1000000:.3f}ms" + (f" ({len(times)}x)" if len(times) > 1 else "")
+            for name, times in self.spans.items()
+        ]
+        return topsep + "Phase timing\n" + "-"*40 + "\n" + "\n".join(lines) + "\n" + topsep